@@ -0,0 +1,128 @@
+"""
+benchAutoWorkup.py
+
+Benchmark of the "proj_subj_session_imagefiles.csv" export.  A synthetic
+ImageEval table is created and exported twice: with the loop
+printAutoWorkupCSV used to run (rebuild and sort the session dictionary
+and the output row for every database row) and with the
+itertools.groupby rewrite.  The time of both exports is printed, and the
+two files are checked to describe the same sessions.  The time taken
+only to read the rows of the export query is printed first.
+
+usage: python benchmarks/benchAutoWorkup.py [--rows 1000000]
+"""
+import argparse,ast,csv,os,random,shutil,sys,tempfile,time
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from createImageEvalDB import IMAGE_EVAL_COLUMNS, ParseXMLFilesAndFillDB
+
+def makeDataBase(Object, count):
+    """ Fills the ImageEval table of "Object" with "count" rows, about four scans per session. """
+    rng = random.Random(0)
+    Object.createDataBase()
+    con = Object.getConnection()
+    rows = list()
+    for i in range(count):
+        fieldDict = dict.fromkeys(IMAGE_EVAL_COLUMNS)
+        fieldDict['project'] = "PHD_{0:03d}".format(i // 4000)
+        fieldDict['subject'] = str(10000 + i // 12)
+        fieldDict['session'] = str(20000 + i // 4)
+        fieldDict['scantype'] = rng.choice(['T1-30', 'T2-30', 'T1-15', 'PD-15', 'T2-15'])
+        fieldDict['overallqaassessment'] = rng.randint(0, 10)
+        fieldDict['imagefile'] = "/paulsen/MRx/{project}/{subject}/{session}/ANONRAW/{subject}_{session}_{scantype}_{0}.nii.gz".format(
+            i % 4, **fieldDict)
+        fieldDict['file_exists'] = int(rng.random() < 0.9)
+        fieldDict['xnatImageReviewID'] = "PREDICTHD_E{0:07d}".format(i)
+        rows.append(tuple(fieldDict[col] for col in IMAGE_EVAL_COLUMNS))
+        if len(rows) == 10000:
+            con.executemany("INSERT INTO ImageEval VALUES ({0});".format(", ".join(["?"] * len(IMAGE_EVAL_COLUMNS))), rows)
+            rows = list()
+    con.executemany("INSERT INTO ImageEval VALUES ({0});".format(", ".join(["?"] * len(IMAGE_EVAL_COLUMNS))), rows)
+    con.commit()
+
+def legacyAutoWorkupCSV(Object):
+    """
+    The loop printAutoWorkupCSV used to run.  pylab's sort() of the
+    dictionary is replaced by the 0-d array copy it made before NumPy 1.13
+    (newer versions raise an AxisError), so the per-row cost is the same.
+    """
+    sort = lambda eval_dict: np.array(eval_dict, dtype = object)
+    Handle = csv.writer(open('proj_subj_session_imagefiles.csv', 'wb'),
+                        quoting=csv.QUOTE_ALL)
+    col_name_list = ["project", "subject", "session", "imagefiles"]
+    Handle.writerow(col_name_list)
+    tmp_session = None
+    line = None
+    SQLiteCommand = "SELECT project, subject, session, overallqaassessment, scantype, imagefile "
+    SQLiteCommand += "FROM ImageEval WHERE overallqaassessment > 5 AND file_exists = 1 "
+    SQLiteCommand += "ORDER BY project, subject, session, scantype, overallqaassessment DESC;"
+    imagefile_info = Object.getConnection().execute(SQLiteCommand).fetchall()
+    _iterator = range(0,len(imagefile_info))
+    for i in _iterator:
+        row = imagefile_info[i]
+        project = str(row[0])
+        subject = str(row[1])
+        session = str(row[2])
+        scan_type = str(row[4])
+        imagefile = str(row[5])
+        if tmp_session != session:
+            eval_dict = dict()
+            eval_dict[scan_type] = [imagefile]
+            if line is not None:
+                Handle.writerow(line)
+        else:
+            if scan_type in eval_dict.keys():
+                eval_dict[scan_type].append(imagefile)
+            else:
+                eval_dict[scan_type] = [imagefile]
+        tmp_session = session
+        sorted_eval_dict = sort(eval_dict)
+        line = (project, subject, session, sorted_eval_dict)
+        ## make sure to print the last row
+        if i == _iterator[-1]:
+            Handle.writerow(line)
+
+def queryOnly(Object):
+    """ Only reads the rows of the export query, the cost both exports share. """
+    SQLiteCommand = "SELECT project, subject, session, overallqaassessment, scantype, imagefile "
+    SQLiteCommand += "FROM ImageEval WHERE overallqaassessment > 5 AND file_exists = 1 "
+    SQLiteCommand += "ORDER BY project, subject, session, scantype, overallqaassessment DESC;"
+    for row in Object.getInfoFromDB(SQLiteCommand):
+        pass
+
+def groupbyAutoWorkupCSV(Object):
+    Object.printAutoWorkupCSV()
+
+def readSessions(fileName):
+    with open(fileName, 'rb') as csv_file:
+        return [tuple(row[:3]) + (ast.literal_eval(row[3]),) for row in list(csv.reader(csv_file))[1:]]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the proj_subj_session_imagefiles.csv export')
+    parser.add_argument('--rows', action='store', type=int, default=1000000,
+                    dest='rows', help='Number of synthetic ImageEval rows')
+    inputArguments = parser.parse_args()
+
+    workDir = tempfile.mkdtemp()
+    try:
+        Object = ParseXMLFilesAndFillDB(cacheDir = None)
+        Object.dbFileName = os.path.join(workDir, 'ImageEvals.db')
+        makeDataBase(Object, inputArguments.rows)
+        start = time.time()
+        queryOnly(Object)
+        print "{0:>22}: {1:.2f} s".format('query only', time.time() - start)
+        sessions = list()
+        for exportFunction in (legacyAutoWorkupCSV, groupbyAutoWorkupCSV):
+            outDir = os.path.join(workDir, exportFunction.__name__)
+            os.mkdir(outDir)
+            os.chdir(outDir)
+            start = time.time()
+            exportFunction(Object)
+            elapsed = time.time() - start
+            sessions.append(readSessions('proj_subj_session_imagefiles.csv'))
+            print "{0:>22}: {1:.2f} s ({2} sessions from {3} rows)".format(
+                exportFunction.__name__, elapsed, len(sessions[-1]), inputArguments.rows)
+        print "same sessions: {0}".format(sessions[0] == sessions[1])
+    finally:
+        os.chdir(os.path.dirname(workDir))
+        shutil.rmtree(workDir)
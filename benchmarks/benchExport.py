@@ -0,0 +1,83 @@
+"""
+benchExport.py
+
+Benchmark of the "ImageEval_database.csv" export.  A synthetic ImageEval
+table is created, then exported in a fresh process by each method: the
+way the export used to be written (one fetchall() of the whole table),
+with the streaming printDBtoCSVfile (fetchmany() batches), with the gzip
+compressed export and with the columnar export.  The time, the peak
+resident memory of the process and the size of the written file are
+printed for each one.
+
+usage: python benchmarks/benchExport.py [--rows 200000]
+"""
+import argparse,csv,os,resource,shutil,subprocess,sys,tempfile,time
+import sqlite3 as lite
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from createImageEvalDB import IMAGE_EVAL_COLUMNS, ParseXMLFilesAndFillDB
+from benchQueries import makeVersion0DataBase
+
+METHODS = ('fetchall', 'stream', 'gzip', 'columnar')
+
+def legacyExport(dbFileName):
+    """ The export before it was streamed: the whole table in one list. """
+    con = lite.connect(dbFileName)
+    dbCur = con.cursor()
+    dbCur.execute("SELECT * FROM ImageEval ORDER BY project, subject, session, seriesnumber, scantype;")
+    DBinfo = dbCur.fetchall()
+    col_name_list = [tuple[0] for tuple in dbCur.description]
+    dbCur.close()
+    with open('ImageEval_database.csv', 'wb') as csv_file:
+        Handle = csv.writer(csv_file, quoting=csv.QUOTE_ALL)
+        Handle.writerow(col_name_list)
+        for row in DBinfo:
+            Handle.writerow(row)
+    return 'ImageEval_database.csv'
+
+def runExport(method, dbFileName):
+    """ Runs one export in the current directory, returns the name of the file it wrote. """
+    if method == 'fetchall':
+        return legacyExport(dbFileName)
+    Object = ParseXMLFilesAndFillDB(cacheDir = None, gzipOutput = (method == 'gzip'))
+    Object.dbFileName = dbFileName
+    if method == 'columnar':
+        Object.printDBtoColumnarFile()
+        return [name for name in os.listdir('.') if name.startswith('ImageEval_database.')][0]
+    Object.printDBtoCSVfile()
+    return 'ImageEval_database.csv.gz' if method == 'gzip' else 'ImageEval_database.csv'
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the ImageEval CSV export')
+    parser.add_argument('--rows', action='store', type=int, default=200000,
+                    dest='rows', help='Number of synthetic ImageEval rows')
+    parser.add_argument('--method', action='store', default=None, choices=METHODS,
+                    dest='method', help=argparse.SUPPRESS)
+    parser.add_argument('--db', action='store', default=None,
+                    dest='db', help=argparse.SUPPRESS)
+    inputArguments = parser.parse_args()
+
+    if inputArguments.method is not None:
+        ## one export, run in its own process so its peak memory can be measured
+        start = time.time()
+        fileName = runExport(inputArguments.method, inputArguments.db)
+        elapsed = time.time() - start
+        print "{0:>10}: {1:6.2f} s, peak memory {2:7.1f} MB, {3} {4:.1f} MB".format(
+            inputArguments.method, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            fileName, os.path.getsize(fileName) / 1024.0 ** 2)
+        sys.exit(0)
+
+    workDir = tempfile.mkdtemp()
+    try:
+        Object = ParseXMLFilesAndFillDB(cacheDir = None)
+        Object.dbFileName = os.path.join(workDir, 'ImageEvals.db')
+        makeVersion0DataBase(Object.dbFileName, inputArguments.rows)
+        Object.createDataBase(keepExisting = True)
+        Object.closeDataBase()
+        print "{0} rows, {1} columns".format(inputArguments.rows, len(IMAGE_EVAL_COLUMNS))
+        for method in METHODS:
+            outDir = os.path.join(workDir, method)
+            os.mkdir(outDir)
+            subprocess.check_call([sys.executable, os.path.abspath(__file__), '--method', method,
+                                   '--db', Object.dbFileName], cwd = outDir)
+    finally:
+        shutil.rmtree(workDir)
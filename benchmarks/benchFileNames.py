@@ -0,0 +1,65 @@
+"""
+benchFileNames.py
+
+Benchmark of the image file name parsing of the database build.  The
+image file names of a synthetic corpus are parsed, and forced to the
+mandated format, three ways: the way _getImageInfo used to do it (compile
+the project pattern for every file name and build the path by string
+concatenation), with imageEvalFileNames.parseImageFile for each file
+name, and with one imageEvalFileNames.parseImageFiles batch.  The three
+results are checked to be the same.
+
+usage: python benchmarks/benchFileNames.py [--count 200000]
+"""
+import argparse,os,re,sys,time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from imageEvalFileNames import makeImageFile, parseImageFile, parseImageFiles
+from syntheticXNAT import makeCorpus
+
+IMAGE_ROOT = "/paulsen/MRx"
+
+def legacyNames(columns):
+    names = list()
+    for (imagefile, project, seriesnumber) in zip(*columns):
+        _image_file = imagefile.strip().split('/')[-1]
+        if project != "PHD_DTI_THP":
+            _image_file_pattern = re.compile('([^_]*)_([^_]*)_([^_]*)_[^-]*')
+        else:
+            _image_file_pattern = re.compile('([^_]*)_([^_]*_[^_]*)_([^_]*)_[^-]*')
+        (subject, session, scan_type) = _image_file_pattern.match(_image_file).groups()
+        names.append((subject, session, scan_type,
+                      os.path.join(IMAGE_ROOT, project, subject, session, "ANONRAW",
+                                   subject + "_" + session + "_" + scan_type + "_" + seriesnumber + ".nii.gz")))
+    return names
+
+def eachNames(columns):
+    names = list()
+    for (imagefile, project, seriesnumber) in zip(*columns):
+        (subject, session, scan_type) = parseImageFile(imagefile, project)
+        names.append((subject, session, scan_type,
+                      makeImageFile(IMAGE_ROOT, project, subject, session, scan_type, seriesnumber)))
+    return names
+
+def batchNames(columns):
+    (imagefiles, projects, seriesnumbers) = columns
+    return zip(*parseImageFiles(imagefiles, projects, projects, seriesnumbers, IMAGE_ROOT))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the image file name parsing')
+    parser.add_argument('--count', action='store', type=int, default=200000,
+                    dest='count', help='Number of image file names')
+    inputArguments = parser.parse_args()
+
+    corpus = makeCorpus(inputArguments.count)
+    columns = ([experiment.fields['Image File'] for experiment in corpus],
+               [experiment.project for experiment in corpus],
+               [experiment.seriesNumber for experiment in corpus])
+    results = list()
+    for namesFunction in (legacyNames, eachNames, batchNames):
+        start = time.time()
+        results.append(namesFunction(columns))
+        elapsed = time.time() - start
+        print "{0:>12}: {1:6.2f} s {2:10.0f} names/s".format(namesFunction.__name__, elapsed,
+                                                             inputArguments.count / elapsed)
+    print "same names: {0}".format(results[0] == results[1] == results[2])
@@ -0,0 +1,87 @@
+"""
+benchMemory.py
+
+Benchmark of the peak memory of "createImageEvalDB.py sync" as the
+experiment listing grows.  For each size a synthetic corpus is served by
+a FakeXNATServer and the sync is run in a child process of its own, with
+the XNAT cache off, in bulk mode (most Image Evals are read from the
+listing) or with --noBulk (every Image Eval XML file is downloaded).  The
+peak resident memory of the child (read from /proc, so Linux only), its
+run time and the number of rows it loaded are printed.  The peak should
+not grow with the number of experiments.
+
+usage: python benchmarks/benchMemory.py [--counts 5000 20000 80000] [--noBulk]
+                                        [--pageSize 5000] [--maxInFlight 0]
+"""
+import argparse,os,shutil,subprocess,sys,tempfile,time
+import sqlite3 as lite
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from syntheticXNAT import makeCorpus, makeImageTree
+from fakeXNAT import FakeXNATServer
+
+PACKAGE_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+## runs the sync command with "arguments", answering the XNAT password prompt, then saves the
+## peak resident memory of the process to "peak_memory" (VmHWM starts over at exec, unlike
+## the ru_maxrss of the child, which keeps the memory of the benchmark it was forked from)
+CHILD = """
+import sys,urllib
+sys.path.insert(0, {0!r})
+urllib.FancyURLopener.prompt_user_passwd = lambda *args: ('benchmark', 'benchmark')
+import createImageEvalDB
+inputArguments = createImageEvalDB.makeArgumentParser().parse_args(['sync'] + {1!r})
+createImageEvalDB.runImageEval(inputArguments, createImageEvalDB.PhaseTimer())
+with open('/proc/self/status') as status:
+    peak = [line.split()[1] for line in status if line.startswith('VmHWM:')][0]
+with open('peak_memory', 'w') as handle:
+    handle.write(peak)
+"""
+
+def runSync(arguments, workDir):
+    """ Run the sync in a child process, returns its peak resident memory in MB and its run time. """
+    start = time.time()
+    with open(os.path.join(workDir, 'sync.log'), 'w') as log:
+        status = subprocess.call([sys.executable, '-c', CHILD.format(PACKAGE_DIR, arguments)], cwd = workDir,
+                                 stdout = log, stderr = subprocess.STDOUT)
+    if status != 0:
+        raise RuntimeError("the sync failed, see {0}".format(os.path.join(workDir, 'sync.log')))
+    with open(os.path.join(workDir, 'peak_memory')) as handle:
+        return int(handle.read()) / 1024.0, time.time() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the peak memory of the sync')
+    parser.add_argument('--counts', action='store', type=int, nargs='+', default=[5000, 20000, 80000],
+                    dest='counts', help='Numbers of synthetic Image Evals')
+    parser.add_argument('--noBulk', action='store_true', default=False,
+                    dest='noBulk', help='Download every Image Eval XML file')
+    parser.add_argument('--pageSize', action='store', type=int, default=5000,
+                    dest='pageSize', help='Number of experiments in each page of the listing')
+    parser.add_argument('--maxInFlight', action='store', type=int, default=0,
+                    dest='maxInFlight', help='Largest number of experiments in the pipeline at once')
+    parser.add_argument('-j', '--workers', action='store', type=int, default=8,
+                    dest='workers', help='Number of fetch and resolve threads')
+    inputArguments = parser.parse_args()
+
+    print "{0:>8} {1:>10} {2:>8} {3:>10}".format('count', 'peak MB', 'time s', 'rows')
+    for count in inputArguments.counts:
+        workDir = tempfile.mkdtemp()
+        imageRoot = os.path.join(workDir, 'paulsen', 'MRx')
+        corpus = makeCorpus(count, imageRoot = imageRoot)
+        makeImageTree(corpus, imageRoot)
+        server = FakeXNATServer(corpus)
+        url = server.start()
+        corpus = None
+        arguments = ['--xnatURL', url, '--imageRoot', imageRoot, '--noCache',
+                     '--pageSize', str(inputArguments.pageSize), '-j', str(inputArguments.workers)]
+        if inputArguments.noBulk:
+            arguments.append('--noBulk')
+        if inputArguments.maxInFlight:
+            arguments += ['--maxInFlight', str(inputArguments.maxInFlight)]
+        try:
+            (peak, elapsed) = runSync(arguments, workDir)
+            con = lite.connect(os.path.join(workDir, 'ImageEvals.db'))
+            rows = con.execute("SELECT COUNT(*) FROM ImageEval;").fetchone()[0]
+            con.close()
+            print "{0:>8} {1:>10.1f} {2:>8.1f} {3:>10}".format(count, peak, elapsed, rows)
+        finally:
+            server.stop()
+            shutil.rmtree(workDir)
@@ -0,0 +1,129 @@
+"""
+benchParser.py
+
+Benchmark of the Image Eval XML parsers.  A corpus of synthetic review XML
+files is parsed with ParseToFields, the parser createImageEvalDB.py used
+before ParseToRecord (the whole document tree plus a field dictionary per
+experiment), and with the streaming ParseToRecord.  The time
+per document and the memory held by the parsed results are printed.
+
+usage: python benchmarks/benchParser.py [--count 20000]
+"""
+import argparse,os,StringIO,sys,time
+from xml.etree import ElementTree as et
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from createImageEvalDB import ParseToRecord
+from syntheticXNAT import makeReviewXMLs
+
+class ParseToFields():
+    """ The original Image Eval XML parser, kept as the reference for ParseToRecord. """
+    def __init__(self,xmlString):
+        self._project       = ""  # The project for this XML main label for this subject,
+                                  # in the form of "{sessionID}_{scanid}_IR
+        self._label         = ""
+        self._imageReviewID = ""
+        self._session       = ""
+        self._subject_ID    = ""
+        self._session_ID    = ""
+        self._session_LABEL = ""
+        self._series_number = ""
+        self._date          = ""
+        self._time          = ""
+        self._fieldDict     = dict({'susceptibilitymetal': 'NULL',
+                              'scantype': 'NULL',
+                              'flowartifact': 'NULL',
+                              'freeformnotes': ' ',
+                              'subject': 'NULL',
+                              'session': 'NULL',
+                              'seriesnumber': 'NULL',
+                              'cnr': 'NULL',
+                              'overallqaassessment': 'NULL',
+                              'truncationartifact': 'NULL',
+                              'ghostingmotion': 'NULL',
+                              'imagefile': 'NULL',
+                              'lesions': 'NULL',
+                              'misalignment': 'NULL',
+                              'snr': 'NULL',
+                              'date': 'NULL',
+                              'evaluator': 'NULL',
+                              'xnatImageReviewLabel': 'NULL',
+                              'fullbraincoverage': 'NULL',
+                              'normalvariants': 'NULL',
+                              'evaluationcompleted': 'NULL',
+                              'project': 'NULL',
+                              'swapwraparound': 'NULL',
+                              'inhomogeneity': 'NULL',
+                              'time': 'NULL'})
+        self._sql_col_names  = list()
+        self._string=xmlString
+        myelem=et.fromstring(self._string)
+
+        self._project=myelem.attrib['project']
+        self._label  =myelem.attrib['label']
+        self._imageReviewID = myelem.attrib['ID']
+        for child in myelem.getiterator():
+            if child.tag == '{http://nrg.wustl.edu/phd}field':
+                myatts=dict(child.items())
+                self._sql_col_names.append(self.makeSQLColName(myatts['name']))
+                if 'value' in myatts.keys(): 
+                    self._fieldDict[self.makeSQLColName(myatts['name'])] = myatts['value']
+                ## Assign an empty string if there is no value for "free form notes".
+                elif 'value' not in myatts.keys() and myatts['name'] == "Free Form Notes":
+                    self._fieldDict[self.makeSQLColName(myatts['name'])] = " "
+                    print "ERROR: No value for \"Free Form Notes\" field in ImageEval for {0}".format(self._imageReviewID)
+                pass
+            elif child.tag  == '{http://nrg.wustl.edu/xnat}date':
+                self._date = child.text
+                pass
+            elif child.tag  == '{http://nrg.wustl.edu/xnat}time':
+                self._time = child.text
+                pass
+            elif child.tag  == '{http://nrg.wustl.edu/phd}series_number':
+                self._series_number = child.text
+                pass
+            elif child.tag  == '{http://nrg.wustl.edu/xnat}imageSession_ID':
+                self._session_ID = child.text
+                pass
+            
+    def makeSQLColName(self, val):
+        val = val.replace(' ','').replace('/','').lower()
+        return val
+
+def retainedBytes(results):
+    """ Approximate size of the parsed results, counting each object's own attributes once. """
+    total = 0
+    for result in results:
+        total += sys.getsizeof(result)
+        if isinstance(result, tuple):
+            total += sum([sys.getsizeof(value) for value in result])
+        else:
+            members = vars(result)
+            total += sys.getsizeof(members)
+            for value in members.values():
+                total += sys.getsizeof(value)
+                if isinstance(value, dict):
+                    total += sum([sys.getsizeof(item) for item in value.values()])
+                elif isinstance(value, list):
+                    total += sum([sys.getsizeof(item) for item in value])
+    return total
+
+def parseAll(parse, xml_list):
+    start = time.time()
+    results = [parse(xmlString) for xmlString in xml_list]
+    return results, time.time() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the Image Eval XML parsers')
+    parser.add_argument('--count', action='store', type=int, default=20000,
+                    dest='count', help='Number of synthetic Image Eval XML files to parse')
+    inputArguments = parser.parse_args()
+    
+    xml_list = makeReviewXMLs(inputArguments.count)
+    record_parser = ParseToRecord()
+    parsers = [('ParseToFields', ParseToFields),
+               ('ParseToRecord', lambda xmlString: record_parser.parse(StringIO.StringIO(xmlString)))]
+    for (name, parse) in parsers:
+        (results, elapsed) = parseAll(parse, xml_list)
+        print "{0:>14}: {1:.1f} us per document, {2:.0f} bytes held per parsed result".format(
+            name, 1e6 * elapsed / len(xml_list), retainedBytes(results) / float(len(results)))
+        results = None
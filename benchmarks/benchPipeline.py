@@ -0,0 +1,173 @@
+"""
+benchPipeline.py
+
+End-to-end and per-stage benchmark of the database build, without
+www.predict-hd.net.  A synthetic corpus of Image Evals is served by a
+FakeXNATServer (with an optional latency per request) and its image files
+are created in a fake "/paulsen/MRx" tree in a temporary directory.
+Each stage is then timed on its own:
+
+    listing     - getExperimentsList, paged, in bulk mode unless --noBulk
+    fetch       - download every Image Eval XML file with --workers threads
+    fetch-cache - the same downloads stored in an XMLCache, as the sync
+                  does by default
+    parse       - parse every XML file in this process
+    resolve     - find the image files of every Image Eval in the fake tree
+    write       - write the rows with ImageEvalWriter
+
+and then the whole build is run (ParseXMLFilesAndFillDB.main), whose
+pipeline counters and phase timings are printed.  The throughputs can be
+saved with --json and compared with a saved run with --baseline: the
+script exits with status 1 when a throughput fell by more than
+--tolerance.
+
+usage: python benchmarks/benchPipeline.py [--count 5000] [--latency 0.02] [--noBulk]
+                                          [--json FILE] [--baseline FILE]
+"""
+import argparse,json,os,shutil,sys,tempfile,time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from createImageEvalDB import (ImageEvalWriter, ImageFileIndex, ParseXMLFilesAndFillDB, PipelineStage,
+                               PhaseTimer, parseImageEvalXML)
+from syntheticXNAT import makeCorpus, makeImageTree
+from fakeXNAT import FakeXNATServer
+
+def makeObject(inputArguments, url, imageRoot, timer = None, cacheDir = None):
+    return ParseXMLFilesAndFillDB(xnatURL = url, workers = inputArguments.workers, cacheDir = cacheDir,
+                                  bulk = not inputArguments.noBulk, pageSize = inputArguments.pageSize,
+                                  parseProcesses = inputArguments.parseProcesses, imageRoot = imageRoot,
+                                  username = 'benchmark', pword = 'benchmark', timer = timer)
+
+def timeStage(name, function, count, results):
+    start = time.time()
+    value = function()
+    elapsed = time.time() - start
+    results[name] = count / elapsed
+    print "{0:>11}: {1:8.2f} s {2:10.1f} items/s".format(name, elapsed, results[name])
+    return value
+
+def fetchAll(Object, expList):
+    """ Download the XML file of every experiment with a fetch stage of its own. """
+    documents = list()
+    def fetch(scan_info):
+        return [Object.fetcher.fetch(Object._getXMLpath(Object._getScanInfo(scan_info)[2]))]
+    stage = PipelineStage('fetch', fetch, workers = Object.workers, finish = Object.fetcher._closeConnection)
+    collector = PipelineStage('collect', lambda xmlString: documents.append(xmlString))
+    stage.next = collector
+    stage.start()
+    collector.start()
+    for scan_info in expList:
+        stage.put(scan_info)
+    stage.close()
+    stage.join()
+    collector.join()
+    return documents
+
+def resolveAll(Object, items):
+    Object.fileIndex = ImageFileIndex()
+    rows = list()
+    for (scan_info, record) in items:
+        (record, imagefile) = Object._getImageInfo(record, scan_info)
+        rows.extend(Object._resolveRows(record, imagefile))
+    return rows
+
+def writeAll(Object, rows):
+    Object.createDataBase()
+    writer = ImageEvalWriter(Object.getConnection(), bulkLoad = True)
+    for row in rows:
+        writer.addRow(row)
+    writer.close()
+    Object.closeDataBase()
+
+def compareWithBaseline(results, baselineFile, tolerance):
+    """ Prints the change of every throughput, returns False if one fell by more than "tolerance". """
+    with open(baselineFile) as handle:
+        baseline = json.load(handle)['throughput']
+    passed = True
+    for (name, value) in sorted(results.items()):
+        if name not in baseline:
+            continue
+        change = value / baseline[name] - 1
+        flag = ""
+        if change < -tolerance:
+            flag = "  REGRESSION"
+            passed = False
+        print "{0:>11}: {1:10.1f} items/s, baseline {2:10.1f} ({3:+.0%}){4}".format(
+            name, value, baseline[name], change, flag)
+    return passed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the ImageEval database build against a fake XNAT')
+    parser.add_argument('--count', action='store', type=int, default=5000,
+                    dest='count', help='Number of synthetic Image Evals')
+    parser.add_argument('--sites', action='store', type=int, default=32,
+                    dest='sites', help='Number of PHD_### sites')
+    parser.add_argument('--latency', action='store', type=float, default=0.0,
+                    dest='latency', help='Delay of every fake XNAT request in seconds')
+    parser.add_argument('--jitter', action='store', type=float, default=0.0,
+                    dest='jitter', help='Maximum random delay added to the latency in seconds')
+    parser.add_argument('--missing', action='store', type=float, default=0.05,
+                    dest='missing', help='Fraction of the image files left out of the fake tree')
+    parser.add_argument('-j', '--workers', action='store', type=int, default=8,
+                    dest='workers', help='Number of fetch and resolve threads')
+    parser.add_argument('--parseProcesses', action='store', type=int, default=0,
+                    dest='parseProcesses', help='Number of parse processes of the end-to-end run')
+    parser.add_argument('--pageSize', action='store', type=int, default=5000,
+                    dest='pageSize', help='Number of experiments in each page of the listing')
+    parser.add_argument('--noBulk', action='store_true', default=False,
+                    dest='noBulk', help='Download every Image Eval XML file in the end-to-end run')
+    parser.add_argument('--json', action='store', default=None,
+                    dest='json', help='Save the throughputs to this JSON file')
+    parser.add_argument('--baseline', action='store', default=None,
+                    dest='baseline', help='Compare the throughputs with a JSON file saved with --json')
+    parser.add_argument('--tolerance', action='store', type=float, default=0.2,
+                    dest='tolerance', help='Largest accepted fall of a throughput compared with the baseline')
+    inputArguments = parser.parse_args()
+
+    workDir = tempfile.mkdtemp()
+    imageRoot = os.path.join(workDir, 'paulsen', 'MRx')
+    corpus = makeCorpus(inputArguments.count, inputArguments.sites, imageRoot = imageRoot)
+    files = makeImageTree(corpus, imageRoot, inputArguments.missing)
+    server = FakeXNATServer(corpus, latency = inputArguments.latency, jitter = inputArguments.jitter)
+    url = server.start()
+    cwd = os.getcwd()
+    os.chdir(workDir)
+    results = dict()
+    try:
+        print "{0} Image Evals in {1} projects, {2} image files, {3:.0f} ms latency".format(
+            len(corpus), len(set([experiment.project for experiment in corpus])), files,
+            inputArguments.latency * 1000)
+        Object = makeObject(inputArguments, url, imageRoot)
+        expList = timeStage('listing', lambda: list(Object.getExperimentsList()), len(corpus), results)
+        documents = timeStage('fetch', lambda: fetchAll(Object, expList), len(corpus), results)
+        cacheObject = makeObject(inputArguments, url, imageRoot, cacheDir = os.path.join(workDir, 'xnat_cache'))
+        cacheObject.connectToXNAT()
+        cacheObject._setListingHeader(Object._listingHeader)
+        timeStage('fetch-cache', lambda: fetchAll(cacheObject, expList), len(corpus), results)
+        cacheObject = None
+        records = timeStage('parse', lambda: [parseImageEvalXML(xmlString) for xmlString in documents],
+                            len(documents), results)
+        documents = None
+        scan_infos = dict((scan_info[Object._expColumns['phd:imagereviewdata/id']], scan_info) for scan_info in expList)
+        items = [(scan_infos[record.xnatImageReviewID], record) for record in records]
+        rows = timeStage('resolve', lambda: resolveAll(Object, items), len(items), results)
+        timeStage('write', lambda: writeAll(Object, rows), len(rows), results)
+        records = items = rows = None
+
+        print "whole build, ParseXMLFilesAndFillDB.main():"
+        timer = PhaseTimer()
+        Object = makeObject(inputArguments, url, imageRoot, timer)
+        timeStage('end-to-end', Object.main, len(corpus), results)
+        timer.printSummary()
+        print "fake XNAT: {0} requests, {1:.1f} MB".format(server.requests.value, server.bytesSent.value / 1024.0 ** 2)
+    finally:
+        os.chdir(cwd)
+        server.stop()
+        shutil.rmtree(workDir)
+
+    if inputArguments.json is not None:
+        with open(inputArguments.json, 'w') as handle:
+            json.dump({'config': vars(inputArguments), 'throughput': results}, handle, indent = 2)
+    if inputArguments.baseline is not None:
+        if not compareWithBaseline(results, inputArguments.baseline, inputArguments.tolerance):
+            sys.exit(1)
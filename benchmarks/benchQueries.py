@@ -0,0 +1,100 @@
+"""
+benchQueries.py
+
+Benchmark of the report queries before and after the migration to the
+current schema.  A synthetic ImageEval table is created with the schema
+version 0 layout (no key or indexes, missing image files marked with a
+text prefix), the report queries are timed, the database is migrated with
+ParseXMLFilesAndFillDB.createDataBase and the same reports are timed
+again with the typed, indexed schema.  The "one session" query looks up
+a session of the synthetic table.
+
+usage: python benchmarks/benchQueries.py [--rows 200000] [--repeat 5]
+"""
+import argparse,os,random,shutil,sys,tempfile,time
+import sqlite3 as lite
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from createImageEvalDB import MISSING_FILE_PREFIX, SCHEMA_VERSION, ParseXMLFilesAndFillDB
+
+V0_COLUMNS = ("project TEXT, subject TEXT, session TEST, seriesnumber INTEGER, scantype TEXT, "
+              "overallqaassessment INTEGER, imagefile TEXT, xnatImageReviewID TEXT")
+
+V0_QUERIES = [("auto workup", "SELECT project, subject, session, overallqaassessment, scantype, imagefile "
+                              "FROM ImageEval WHERE overallqaassessment > 5 AND substr(imagefile,0,5) != 'File' "
+                              "ORDER BY project, subject, session, scantype, overallqaassessment DESC;"),
+              ("not in file system", "SELECT substr(imagefile,38) FROM ImageEval "
+                                     "WHERE overallqaassessment > 5 AND substr(imagefile,0,5) = 'File' "
+                                     "ORDER BY project, subject, session, scantype, overallqaassessment DESC;"),
+              ("site scan types", "SELECT DISTINCT scantype FROM ImageEval WHERE project = 'PHD_024';"),
+              ("site scores", "SELECT overallqaassessment FROM ImageEval WHERE project = 'PHD_024' AND scantype = 'T1-30';"),
+              ("one session", "SELECT * FROM ImageEval WHERE project = '{project}' AND subject = '{subject}' "
+                              "AND session = '{session}';")]
+
+V1_QUERIES = [("auto workup", "SELECT project, subject, session, overallqaassessment, scantype, imagefile "
+                              "FROM ImageEval WHERE overallqaassessment > 5 AND file_exists = 1 "
+                              "ORDER BY project, subject, session, scantype, overallqaassessment DESC;"),
+              ("not in file system", "SELECT imagefile FROM ImageEval "
+                                     "WHERE overallqaassessment > 5 AND file_exists = 0 "
+                                     "ORDER BY project, subject, session, scantype, overallqaassessment DESC;"),
+              ("site scan types", V0_QUERIES[2][1]),
+              ("site scores", V0_QUERIES[3][1]),
+              ("one session", V0_QUERIES[4][1])]
+
+def makeVersion0DataBase(dbFileName, count):
+    """ Creates the schema version 0 ImageEval table, returns the key of one of its sessions. """
+    rng = random.Random(0)
+    con = lite.connect(dbFileName)
+    con.execute("CREATE TABLE ImageEval({0});".format(V0_COLUMNS))
+    rows = list()
+    for i in range(count):
+        project = "PHD_{0:03d}".format(rng.randint(1, 40))
+        subject = str(10000 + i // 6)
+        session = str(20000 + i // 3)
+        scan_type = rng.choice(['T1-30', 'T2-30', 'T1-15', 'PD-15', 'T2-15'])
+        imagefile = "/paulsen/MRx/{0}/{1}/{2}/ANONRAW/{1}_{2}_{3}_2.nii.gz".format(project, subject, session, scan_type)
+        if rng.random() < 0.1:
+            imagefile = MISSING_FILE_PREFIX + imagefile
+        rows.append((project, subject, session, '2', scan_type, str(rng.randint(0, 10)), imagefile,
+                     "PREDICTHD_E{0:06d}".format(i)))
+    con.executemany("INSERT INTO ImageEval VALUES (?, ?, ?, ?, ?, ?, ?, ?);", rows)
+    con.commit()
+    con.close()
+    (project, subject, session) = rows[count // 2][:3]
+    return {'project': project, 'subject': subject, 'session': session}
+
+def timeQueries(dbFileName, queries, repeat, sessionKey):
+    con = lite.connect(dbFileName)
+    for (name, query) in queries:
+        query = query.format(**sessionKey)
+        best = None
+        for i in range(repeat):
+            start = time.time()
+            count = len(con.execute(query).fetchall())
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        print "    {0:>20}: {1:8.2f} ms ({2} rows)".format(name, best * 1000, count)
+    con.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the report queries on both schema versions')
+    parser.add_argument('--rows', action='store', type=int, default=200000,
+                    dest='rows', help='Number of synthetic ImageEval rows')
+    parser.add_argument('--repeat', action='store', type=int, default=5,
+                    dest='repeat', help='Number of times each query is run, the best time is printed')
+    inputArguments = parser.parse_args()
+    
+    workDir = tempfile.mkdtemp()
+    try:
+        Object = ParseXMLFilesAndFillDB(cacheDir = None)
+        Object.dbFileName = os.path.join(workDir, 'ImageEvals.db')
+        sessionKey = makeVersion0DataBase(Object.dbFileName, inputArguments.rows)
+        print "schema version 0:"
+        timeQueries(Object.dbFileName, V0_QUERIES, inputArguments.repeat, sessionKey)
+        start = time.time()
+        Object.createDataBase(keepExisting = True)
+        print "migration: {0:.2f} s".format(time.time() - start)
+        print "schema version {0}:".format(SCHEMA_VERSION)
+        timeQueries(Object.dbFileName, V1_QUERIES, inputArguments.repeat, sessionKey)
+    finally:
+        shutil.rmtree(workDir)
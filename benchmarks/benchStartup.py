@@ -0,0 +1,67 @@
+"""
+benchStartup.py
+
+Benchmark of the start of createImageEvalDB.py.  Each command is run with
+--help in a fresh interpreter, which imports the module and parses the
+command line and then exits, and the best time of --repeat runs is
+printed along with the start of a bare interpreter.  The modules each
+command has imported when its work begins are also checked: only "plot"
+may import matplotlib and NumPy.  The script exits with status 1 when
+"sync" or "export" take longer than --budget seconds or import either.
+
+usage: python benchmarks/benchStartup.py [--repeat 10] [--budget 0.25]
+"""
+import argparse,os,subprocess,sys,time
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'createImageEvalDB.py')
+## the commands whose start must stay under the budget
+BUDGET_COMMANDS = ('sync', 'export')
+## the modules that only "plot" may import
+PLOT_MODULES = ('matplotlib', 'numpy')
+## imports the module as "command" does and prints which PLOT_MODULES are loaded when its work begins
+IMPORTED = """
+import sys
+sys.path.insert(0, {0!r})
+sys.argv = ['createImageEvalDB.py', {1!r}]
+import createImageEvalDB
+if {1!r} == 'plot':
+    createImageEvalDB.importPlotting()
+print " ".join([name for name in {2!r} if name in sys.modules])
+"""
+
+def bestTime(arguments, repeat):
+    """ The shortest wall time of "repeat" runs of the command line "arguments". """
+    times = list()
+    with open(os.devnull, 'w') as devnull:
+        for i in range(repeat):
+            start = time.time()
+            subprocess.check_call(arguments, stdout = devnull, stderr = devnull)
+            times.append(time.time() - start)
+    return min(times)
+
+def plotImports(command):
+    """ The PLOT_MODULES imported by "command". """
+    code = IMPORTED.format(os.path.dirname(os.path.abspath(SCRIPT)), command, PLOT_MODULES)
+    return subprocess.check_output([sys.executable, '-c', code]).split()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the start of createImageEvalDB.py')
+    parser.add_argument('--repeat', action='store', type=int, default=10,
+                    dest='repeat', help='Number of runs of each command, the best one is kept')
+    parser.add_argument('--budget', action='store', type=float, default=0.25,
+                    dest='budget', help='Longest accepted start of "sync" and "export" in seconds')
+    inputArguments = parser.parse_args()
+
+    print "{0:>12}: {1:6.3f} s".format('interpreter', bestTime([sys.executable, '-c', 'pass'], inputArguments.repeat))
+    passed = True
+    for command in ('sync', 'export', 'plot'):
+        elapsed = bestTime([sys.executable, SCRIPT, command, '--help'], inputArguments.repeat)
+        imported = plotImports(command)
+        flag = ""
+        if command in BUDGET_COMMANDS and (elapsed > inputArguments.budget or imported):
+            flag = "  OVER BUDGET" if elapsed > inputArguments.budget else "  IMPORTS " + " AND ".join(imported).upper()
+            passed = False
+        print "{0:>12}: {1:6.3f} s, imported: {2}{3}".format(command, elapsed, ", ".join(imported) or "-", flag)
+    print "budget of {0}: {1:.3f} s".format(" and ".join(BUDGET_COMMANDS), inputArguments.budget)
+    if not passed:
+        sys.exit(1)
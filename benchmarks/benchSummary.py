@@ -0,0 +1,107 @@
+"""
+benchSummary.py
+
+Benchmark of the score summaries of the boxplots as the ImageEval table
+grows.  For each size a database is built with createDataBase and loaded
+with ImageEvalWriter twice: as a bulk load, which refills ScoreHistogram
+once at the end, and with the ScoreHistogram triggers updating it row by
+row as in an incremental sync (with the pragmas of a bulk load, so only
+the histogram differs).  Then the boxplot statistics of every (site, scan
+type) group are computed the way the boxplots used to be made (every
+score read from ImageEval and matplotlib.cbook.boxplot_stats) and with
+ScoreSummary on both databases, and the results are checked to be the
+same.
+
+usage: python benchmarks/benchSummary.py [--rows 10000 100000 1000000]
+"""
+import argparse,collections,os,shutil,sys,tempfile,time
+import sqlite3 as lite
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import createImageEvalDB
+from createImageEvalDB import ImageEvalRecord, ImageEvalWriter, ParseXMLFilesAndFillDB, ScoreSummary
+from benchWriter import makeSyntheticRows
+
+def buildDataBase(dbFileName, rows, bulkLoad):
+    """ Loads "rows" into a new database, returns the load time. """
+    Object = ParseXMLFilesAndFillDB(cacheDir = None, username = 'benchmark', pword = 'benchmark')
+    Object.dbFileName = dbFileName
+    Object.createDataBase()
+    con = Object.getConnection()
+    if not bulkLoad:
+        con.execute("PRAGMA journal_mode=WAL;")
+        con.execute("PRAGMA synchronous=OFF;")
+    start = time.time()
+    writer = ImageEvalWriter(con, bulkLoad = bulkLoad)
+    for fieldDict in rows:
+        writer.addRow(ImageEvalRecord(**fieldDict))
+    writer.close()
+    elapsed = time.time() - start
+    Object.closeDataBase()
+    return elapsed
+
+def rawStats(dbFileName):
+    """ The boxplot statistics of every group from all the scores of ImageEval. """
+    from matplotlib import cbook
+    con = lite.connect(dbFileName)
+    groups = collections.defaultdict(list)
+    for (project, scantype, score) in con.execute("SELECT project, scantype, overallqaassessment FROM ImageEval "
+                                                  "WHERE overallqaassessment IS NOT NULL;"):
+        groups[(project, scantype)].append(score)
+    con.close()
+    return dict((key, cbook.boxplot_stats(np.array(scores, dtype = float))[0])
+                for (key, scores) in groups.items())
+
+def summaryStats(dbFileName):
+    """ The boxplot statistics of every group from ScoreSummary. """
+    summary = ScoreSummary(dbFileName)
+    stats = dict()
+    for site in summary.sites:
+        for scan_type in summary.scanTypes:
+            group = summary.getGroup(site, scan_type)
+            if group is not None:
+                stats[(site, scan_type)] = group[2]
+    return stats
+
+def sameStats(first, second):
+    """ True if both have the same groups and statistics, the fliers in any order. """
+    if sorted(first) != sorted(second):
+        return False
+    for key in first:
+        for name in ('mean', 'med', 'q1', 'q3', 'cilo', 'cihi', 'whislo', 'whishi'):
+            if not np.allclose(first[key][name], second[key][name]):
+                return False
+        if sorted(first[key]['fliers']) != sorted(second[key]['fliers']):
+            return False
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the boxplot score summaries')
+    parser.add_argument('--rows', action='store', type=int, nargs='+', default=[10000, 100000, 1000000],
+                    dest='rows', help='Sizes of the ImageEval table')
+    inputArguments = parser.parse_args()
+
+    createImageEvalDB.importPlotting()
+    workDir = tempfile.mkdtemp()
+    try:
+        print "{0:>8} {1:>12} {2:>12} {3:>10} {4:>10} {5}".format(
+            'rows', 'bulk s', 'triggers s', 'raw ms', 'summary ms', 'same')
+        for count in inputArguments.rows:
+            rows = makeSyntheticRows(count)
+            triggerFileName = os.path.join(workDir, 'triggers.db')
+            triggered = buildDataBase(triggerFileName, rows, False)
+            dbFileName = os.path.join(workDir, 'ImageEvals.db')
+            bulk = buildDataBase(dbFileName, rows, True)
+            rows = None
+            start = time.time()
+            raw = rawStats(dbFileName)
+            raw_time = time.time() - start
+            start = time.time()
+            summary = summaryStats(dbFileName)
+            summary_time = time.time() - start
+            print "{0:>8} {1:>12.2f} {2:>12.2f} {3:>10.1f} {4:>10.1f} {5}".format(
+                count, bulk, triggered, raw_time * 1000, summary_time * 1000,
+                sameStats(raw, summary) and sameStats(raw, summaryStats(triggerFileName)))
+    finally:
+        shutil.rmtree(workDir)
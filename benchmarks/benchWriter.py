@@ -0,0 +1,78 @@
+"""
+benchWriter.py
+
+Micro-benchmark of the ImageEval database writer.  A synthetic table of
+image evaluations is loaded twice into a temporary database made by
+ParseXMLFilesAndFillDB.createDataBase, so with the key, indexes and
+ScoreHistogram triggers of the real ImageEval table: first the way the
+database used to be filled (one string-formatted INSERT and one commit per
+row), then with ImageEvalWriter (one parameterized INSERT, executemany()
+batches and chunked commits).  The rows per second of both loads are printed.
+
+usage: python benchmarks/benchWriter.py [--rows 100000]
+"""
+import argparse,os,random,shutil,sys,tempfile,time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from createImageEvalDB import IMAGE_EVAL_COLUMNS, ImageEvalRecord, ImageEvalWriter, ParseXMLFilesAndFillDB
+
+def makeSyntheticRows(count):
+    """ Returns "count" ImageEval field dictionaries with random values. """
+    rows = list()
+    scan_types = ['T1-30', 'T2-30', 'T1-15', 'T2-15', 'PD-15']
+    for i in range(count):
+        fieldDict = dict((col, 'Yes') for col in IMAGE_EVAL_COLUMNS)
+        fieldDict['project'] = 'PHD_{0:03d}'.format(random.randint(1, 40))
+        fieldDict['subject'] = str(10000 + i // 10)
+        fieldDict['session'] = str(i)
+        fieldDict['seriesnumber'] = str(random.randint(1, 20))
+        fieldDict['scantype'] = random.choice(scan_types)
+        fieldDict['overallqaassessment'] = str(random.randint(0, 10))
+        fieldDict['freeformnotes'] = "Reviewer's note {0}".format(i)
+        fieldDict['xnatImageReviewID'] = 'PREDICTHD_E{0:05d}'.format(i)
+        rows.append(fieldDict)
+    return rows
+
+def legacyLoad(con, rows):
+    """ One string-formatted INSERT and one commit per row. """
+    dbCur = con.cursor()
+    for fieldDict in rows:
+        _col_names_str = ", ".join(fieldDict.keys())
+        _row = ", ".join(["'{0}'".format(value.replace("'", "''")) for value in fieldDict.values()])
+        dbCur.execute("INSERT INTO ImageEval ({0}) VALUES ({1});".format(_col_names_str, _row))
+        con.commit()
+    dbCur.close()
+
+def writerLoad(con, rows):
+    """ The ImageEvalWriter bulk load used by fillDBFromXMLs. """
+    writer = ImageEvalWriter(con, bulkLoad = True)
+    for fieldDict in rows:
+        writer.addRow(ImageEvalRecord(**fieldDict))
+    writer.close()
+
+def timeLoad(loadFunction, rows, workDir):
+    Object = ParseXMLFilesAndFillDB(cacheDir = None, username = 'benchmark', pword = 'benchmark')
+    Object.dbFileName = os.path.join(workDir, loadFunction.__name__ + '.db')
+    Object.createDataBase()
+    con = Object.getConnection()
+    start = time.time()
+    loadFunction(con, rows)
+    elapsed = time.time() - start
+    count = con.execute("SELECT COUNT(*) FROM ImageEval;").fetchone()[0]
+    Object.closeDataBase()
+    return count, elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the ImageEval database writer')
+    parser.add_argument('--rows', action='store', type=int, default=100000,
+                    dest='rows', help='Number of synthetic rows to load')
+    inputArguments = parser.parse_args()
+    
+    rows = makeSyntheticRows(inputArguments.rows)
+    workDir = tempfile.mkdtemp()
+    try:
+        for loadFunction in (legacyLoad, writerLoad):
+            (count, elapsed) = timeLoad(loadFunction, rows, workDir)
+            print "{0:>12}: {1} rows in {2:.2f} s ({3:.0f} rows/sec)".format(
+                loadFunction.__name__, count, elapsed, count / elapsed)
+    finally:
+        shutil.rmtree(workDir)
@@ -0,0 +1,131 @@
+"""
+fakeXNAT.py
+
+A local stand-in for the XNAT REST interface used by the benchmarks.  It
+serves the experiment listing (with the "columns", "sortBy", "offset"
+and "limit" parameters) and the Image Eval XML file of every experiment
+of a synthetic corpus (see syntheticXNAT.makeCorpus).  Every request can be
+delayed by a fixed latency plus a random jitter to imitate a remote
+server.  The server runs in its own process so that it does not compete
+with the code being measured for the interpreter lock.
+
+usage: python benchmarks/fakeXNAT.py [--count 1000] [--port 8080] [--latency 0.05]
+"""
+import argparse,multiprocessing,os,random,sys,time,urlparse
+import BaseHTTPServer,SocketServer
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from syntheticXNAT import makeCorpus, makeExperimentXML, makeListingCSV
+
+class FakeXNATHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    ## send each response in one piece, small separate writes hit the delayed ACK of keep-alive clients
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        delay = server.latency + server.rng.random() * server.jitter
+        if delay > 0:
+            time.sleep(delay)
+        url = urlparse.urlsplit(self.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        if url.path.endswith('/REST/experiments'):
+            columns = query.get('columns', '')
+            if server.rejectBulk and 'fields/field' in columns:
+                return self.send(400)
+            offset = int(query.get('offset', 0))
+            limit = int(query.get('limit', 0))
+            if server.ignorePaging:
+                (offset, limit) = (0, 0)
+            corpus = server.corpus
+            if server.unsorted and query.get('sortBy') != 'ID':
+                corpus = server.rng.sample(corpus, len(corpus))
+            return self.send(200, makeListingCSV(corpus, columns, offset, limit), 'text/csv')
+        experiment = server.experiments.get(url.path.rsplit('/', 1)[-1])
+        if experiment is None:
+            return self.send(404)
+        self.send(200, makeExperimentXML(experiment), 'text/xml')
+
+    def send(self, status, body = '', contentType = 'text/plain'):
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.counterLock:
+            self.server.requests.value += 1
+            self.server.bytesSent.value += len(body)
+
+class FakeXNATServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serve "corpus" on 127.0.0.1:"port" (0 picks a free port).  "latency"
+    and "jitter" are in seconds.  With "rejectBulk" the listing answers
+    HTTP 400 to requests for Image Eval field columns, and with
+    "ignorePaging" it always returns the whole listing, as some XNAT
+    versions do.  With "unsorted" a listing that is not sorted by ID
+    ("sortBy=ID") comes in a new order on every request, so its pages
+    overlap and miss experiments.  start() runs the server in a child process and returns
+    its base URL.  The "requests" and "bytesSent" counters are shared with
+    that process.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, corpus, port = 0, latency = 0.0, jitter = 0.0, rejectBulk = False,
+                 ignorePaging = False, unsorted = False, seed = 0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), FakeXNATHandler)
+        self.corpus = sorted(corpus, key = lambda experiment: experiment.ID)
+        self.experiments = dict((experiment.ID, experiment) for experiment in corpus)
+        self.latency = latency
+        self.jitter = jitter
+        self.rejectBulk = rejectBulk
+        self.ignorePaging = ignorePaging
+        self.unsorted = unsorted
+        self.rng = random.Random(seed)
+        self.requests = multiprocessing.Value('l', 0)
+        self.bytesSent = multiprocessing.Value('l', 0)
+        self.counterLock = multiprocessing.Lock()
+        self._process = None
+
+    def getURL(self):
+        return "http://127.0.0.1:{0}/xnat".format(self.server_address[1])
+
+    def start(self):
+        self._process = multiprocessing.Process(target = self.serve_forever)
+        self._process.daemon = True
+        self._process.start()
+        self.socket.close()  ## the child process owns the listening socket now
+        return self.getURL()
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve a synthetic XNAT corpus')
+    parser.add_argument('--count', action='store', type=int, default=1000,
+                    dest='count', help='Number of synthetic Image Evals')
+    parser.add_argument('--sites', action='store', type=int, default=32,
+                    dest='sites', help='Number of PHD_### sites')
+    parser.add_argument('--port', action='store', type=int, default=8080,
+                    dest='port', help='Port to listen on')
+    parser.add_argument('--latency', action='store', type=float, default=0.0,
+                    dest='latency', help='Delay of every request in seconds')
+    parser.add_argument('--jitter', action='store', type=float, default=0.0,
+                    dest='jitter', help='Maximum random delay added to the latency in seconds')
+    parser.add_argument('--rejectBulk', action='store_true', default=False,
+                    dest='rejectBulk', help='Answer HTTP 400 to listings with Image Eval field columns')
+    parser.add_argument('--unsorted', action='store_true', default=False,
+                    dest='unsorted', help='Shuffle every listing that is not sorted by ID')
+    inputArguments = parser.parse_args()
+
+    server = FakeXNATServer(makeCorpus(inputArguments.count, inputArguments.sites), inputArguments.port,
+                            inputArguments.latency, inputArguments.jitter, inputArguments.rejectBulk,
+                            unsorted = inputArguments.unsorted)
+    print "Serving {0} Image Evals at {1}".format(inputArguments.count, server.getURL())
+    server.serve_forever()
@@ -0,0 +1,177 @@
+"""
+syntheticXNAT.py
+
+Synthetic Image Eval data for the benchmarks.  The generated
+"phd:imageReviewData" XML files have the same structure as the ones
+downloaded from XNAT and parsed by ParseToRecord, and
+makeListingCSV() writes the experiment listing that getExperimentsList
+reads.  makeCorpus() builds a whole XNAT project of Image Evals with
+sites of realistic sizes and scan type mixes, and makeImageTree() the
+matching image files in a fake "/paulsen/MRx" tree.
+"""
+import collections,csv,os,random,StringIO,sys
+from xml.sax.saxutils import quoteattr
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from createImageEvalDB import LISTING_COLUMNS, REVIEW_FIELDS
+
+REVIEW_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<phd:ImageReviewData ID="{ID}" project="{project}" label="{label}" xmlns:xnat="http://nrg.wustl.edu/xnat" xmlns:phd="http://nrg.wustl.edu/phd" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+<xnat:date>{date}</xnat:date>
+<xnat:time>{time}</xnat:time>
+<xnat:imageSession_ID>{sessionID}</xnat:imageSession_ID>
+<phd:series_number>{seriesNumber}</phd:series_number>
+<phd:fields>
+{fields}
+</phd:fields>
+</phd:ImageReviewData>
+"""
+
+## scan types of the evaluated images and how often each one is evaluated
+SCAN_TYPE_MIX = [('T1-30', 30), ('T2-30', 25), ('T1-15', 10), ('PDT2-15', 20), ('PD-15', 8), ('T2-15', 7)]
+## the multi-site DTI project, whose session labels contain an underscore
+DTI_PROJECT = 'PHD_DTI_THP'
+
+## one Image Eval of the corpus, "fields" are the values of its "phd:field" elements
+Experiment = collections.namedtuple('Experiment', ['ID', 'label', 'subjectID', 'project', 'subject', 'session',
+                                                   'scanType', 'seriesNumber', 'date', 'time', 'insertDate',
+                                                   'lastModified', 'fields'])
+
+def makeExperiment(imageReviewID, project, subject, session, scanType, seriesNumber, score,
+                   imageRoot = "/paulsen/MRx", rng = random):
+    """ Returns an Experiment with random review fields. """
+    fields = dict((name, rng.choice(['Yes', 'No'])) for name in REVIEW_FIELDS)
+    fields['Overall QA Assessment'] = str(score)
+    fields['Evaluator'] = rng.choice(['jsmith', 'adoe', 'kjones'])
+    fields['Image File'] = "{0}/{1}/{2}/{3}/ANONRAW/{2}_{3}_{4}_{5}.nii.gz".format(
+        imageRoot, project, subject, session, scanType, seriesNumber)
+    ## one UTF-8 note, so that non-ASCII text goes through the listing and the XML files
+    fields['Free Form Notes'] = rng.choice(["", "Slight motion, it's usable", "Wrap around at the vertex",
+                                            "Re-scanned, see Dr. M\xc3\xbcller's notes"])
+    insert_date = "2011-03-{0:02d} 10:00:00.0".format(rng.randint(1, 28))
+    last_modified = rng.choice(["", "2012-01-{0:02d} 09:30:00.0".format(rng.randint(1, 28))])
+    return Experiment(imageReviewID, "{0}_{1}_IR".format(subject, seriesNumber), "PREDICTHD_S{0}".format(subject),
+                      project, subject, session, scanType, seriesNumber,
+                      "2011-03-{0:02d}".format(rng.randint(1, 28)),
+                      "{0:02d}:{1:02d}:00".format(rng.randint(8, 17), rng.randint(0, 59)),
+                      insert_date, last_modified, fields)
+
+def makeExperimentXML(experiment):
+    """ Returns the Image Eval XML file of an Experiment, an empty field has no value as XNAT writes it. """
+    fields = "\n".join(["<phd:field name={0}{1}/>".format(quoteattr(name), experiment.fields[name] and
+                                                           " value={0}".format(quoteattr(experiment.fields[name])))
+                        for name in REVIEW_FIELDS])
+    return REVIEW_XML.format(ID = experiment.ID, project = experiment.project, label = experiment.label,
+                             date = experiment.date, time = experiment.time,
+                             sessionID = "PREDICTHD_E{0}".format(experiment.session),
+                             seriesNumber = experiment.seriesNumber, fields = fields)
+
+def makeReviewXML(imageReviewID, project, subject, session, scanType, seriesNumber, score,
+                  imageRoot = "/paulsen/MRx", rng = random):
+    """ Returns the XML string of one Image Eval. """
+    return makeExperimentXML(makeExperiment(imageReviewID, project, subject, session, scanType,
+                                            seriesNumber, score, imageRoot, rng))
+
+def makeReviewXMLs(count, seed = 0):
+    """ Returns "count" Image Eval XML strings with random sites, scan types and scores. """
+    rng = random.Random(seed)
+    scan_types = ['T1-30', 'T2-30', 'T1-15', 'PDT2-15', 'PD-15', 'T2-15']
+    xml_list = list()
+    for i in range(count):
+        xml_list.append(makeReviewXML("PREDICTHD_E{0:05d}".format(i), "PHD_{0:03d}".format(rng.randint(1, 40)),
+                                      str(10000 + i // 6), str(20000 + i // 3), rng.choice(scan_types),
+                                      str(rng.randint(1, 20)), rng.randint(0, 10), rng = rng))
+    return xml_list
+
+def makeCorpus(count, sites = 32, seed = 0, imageRoot = "/paulsen/MRx"):
+    """
+    Returns "count" Experiments spread over "sites" PHD_### projects and
+    the PHD_DTI_THP project.  Site sizes fall off like 1/rank, as the
+    enrollment of the PREDICT-HD sites does.  Each subject has one to
+    three sessions and each session about four evaluated scans drawn from
+    SCAN_TYPE_MIX.  Scores are mostly good, with a tail of failed scans.
+    """
+    rng = random.Random(seed)
+    projects = ["PHD_{0:03d}".format(number) for number in rng.sample(range(1, 200), sites)] + [DTI_PROJECT]
+    project_weights = [1.0 / rank for rank in range(1, sites + 1)] + [1.0 / (sites // 2 + 1)]
+    scan_types = [scan_type for (scan_type, weight) in SCAN_TYPE_MIX for i in range(weight)]
+    corpus = list()
+    subject_number = 10000
+    session_number = 20000
+    while len(corpus) < count:
+        project = weightedChoice(projects, project_weights, rng)
+        subject_number += 1
+        for visit in range(rng.randint(1, 3)):
+            session_number += 1
+            session = str(session_number)
+            if project == DTI_PROJECT:
+                session = "{0}_{1}".format(session_number, visit + 1)
+            for series in range(2, 2 + rng.randint(2, 6)):
+                if len(corpus) == count:
+                    break
+                score = min(10, max(0, int(rng.gauss(7, 2.5))))
+                corpus.append(makeExperiment("PREDICTHD_E{0:06d}".format(len(corpus)), project, str(subject_number),
+                                             session, rng.choice(scan_types), str(series), score, imageRoot, rng))
+    return corpus
+
+def weightedChoice(values, weights, rng):
+    threshold = rng.random() * sum(weights)
+    for (value, weight) in zip(values, weights):
+        threshold -= weight
+        if threshold < 0:
+            return value
+    return values[-1]
+
+def makeListingCSV(corpus, columns, offset = 0, limit = 0):
+    """
+    Returns the experiment listing of "corpus" as XNAT writes it for
+    /REST/experiments?format=csv&columns=...: the experiment ID, the
+    requested "columns" (a comma separated string) and the URI of each
+    experiment.  "offset" and "limit" select a page, 0 returns every row.
+    """
+    field_columns = dict((xnat_col.lower(), xnat_col.split('name=')[1].split(']')[0])
+                         for (col, xnat_col) in LISTING_COLUMNS if 'name=' in xnat_col)
+    columns = [col for col in columns.split(',') if col]
+    out = StringIO.StringIO()
+    writer = csv.writer(out, quoting = csv.QUOTE_ALL)
+    writer.writerow(['phd:imagereviewdata/id'] + [col.lower() for col in columns] + ['URI'])
+    rows = corpus[offset:offset + limit] if limit else corpus[offset:]
+    for experiment in rows:
+        values = {'project': experiment.project, 'phd:imagereviewdata/label': experiment.label,
+                  'xnat:subjectdata/id': experiment.subjectID, 'insert_date': experiment.insertDate,
+                  'last_modified': experiment.lastModified, 'date': experiment.date, 'time': experiment.time,
+                  'phd:imagereviewdata/series_number': experiment.seriesNumber}
+        row = [experiment.ID]
+        for col in columns:
+            col = col.lower()
+            if col in field_columns:
+                row.append(experiment.fields[field_columns[col]])
+            else:
+                row.append(values.get(col, ""))
+        writer.writerow(row + ["/data/experiments/" + experiment.ID])
+    return out.getvalue()
+
+def makeImageTree(corpus, root, missing = 0.05, seed = 0):
+    """
+    Create the (empty) image files of "corpus" under "root", named the way
+    fillDBFromXMLs expects them: <root>/<project>/<subject>/<session>/ANONRAW/
+    <subject>_<session>_<scan type>_<series>.nii.gz.  A PDT2-15 scan has a
+    PD-15 and a T2-15 file.  A "missing" fraction of the files is left out.
+    Returns the number of files created.
+    """
+    rng = random.Random(seed)
+    created = 0
+    for experiment in corpus:
+        image_dir = os.path.join(root, experiment.project, experiment.subject, experiment.session, "ANONRAW")
+        scan_types = [experiment.scanType]
+        if experiment.scanType in ('PDT2-15', 'PD-15', 'T2-15'):
+            scan_types = ['PD-15', 'T2-15']
+        for scan_type in scan_types:
+            if rng.random() < missing:
+                continue
+            if not os.path.isdir(image_dir):
+                os.makedirs(image_dir)
+            name = "{0}_{1}_{2}_{3}.nii.gz".format(experiment.subject, experiment.session, scan_type,
+                                                   experiment.seriesNumber)
+            open(os.path.join(image_dir, name), 'w').close()
+            created += 1
+    return created
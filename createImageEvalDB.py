@@ -8,45 +8,264 @@ graph the overall image evaluation scores by the image scan type
 [ImageEvalBoxplots_perScanType_perSite.pdf] and (b) a boxplot graphing the
 overall image evaluation scores by image scan type
 [ImageEvalBoxplot_perScanType.pdf].  The ImageEval database is printed to a
-CSV file called "ImageEval_database.csv". 
- 
+CSV file called "ImageEval_database.csv".
+
+Each step can also be run on its own:
+    createImageEvalDB.py sync    - build or update ImageEvals.db from XNAT
+    createImageEvalDB.py export  - write the CSV files of ImageEvals.db
+    createImageEvalDB.py plot    - make the boxplot PDF files of ImageEvals.db
+Only "plot" imports matplotlib, and always with the Agg backend.  NumPy
+is only imported by the boxplots and the columnar export files.
+
+The per site boxplots are rendered by a pool of --plotProcesses processes
+and joined with PyPDF2, an optional dependency (pip install PyPDF2).
+Without PyPDF2 they are rendered one after another in the main process.
+
 written by Jessica Forbes
 """
 from xml.etree import ElementTree as et
+try:
+    from xml.etree import cElementTree as cet
+except ImportError:
+    cet = et
 import csv
 import string
 import sys
-print sys.path
 import sqlite3 as lite
 import urllib
 import os,argparse,ConfigParser,getpass,subprocess,tempfile,shutil,re
 import glob,datetime,stat, getopt
-from time import localtime
-from pylab import *
-from matplotlib.backends.backend_pdf import PdfPages as pdfpages
+import httplib,urlparse,base64,threading,Queue,hashlib,gzip,time,collections,StringIO,json
+import multiprocessing,itertools,operator,contextlib,cProfile,pstats,random
+from time import localtime, sleep
+from imageEvalFileNames import NOT_FOUND, PDT2_SCAN_TYPES, getPDT2ImageFiles, makeImageFile, parseImageFile, parseImageFiles
+
+## the plotting libraries, imported by importPlotting() when the boxplots are made
+Figure = FigureCanvasAgg = pdfpages = PdfFileMerger = rcParams = None
+
+def importPlotting():
+    """
+    Import matplotlib, with the Agg backend so that no display is needed,
+    and PyPDF2 if it is installed.  Only the plot stage imports them, the
+    sync and export commands start without their import cost.
+    """
+    global Figure, FigureCanvasAgg, pdfpages, PdfFileMerger, rcParams
+    if Figure is not None:
+        return
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import rcParams
+    from matplotlib.backends.backend_pdf import PdfPages as pdfpages
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    try:
+        from PyPDF2 import PdfFileMerger
+    except ImportError:
+        PdfFileMerger = None
+        
+def importPyArrow():
+    """ Returns the pyarrow module, with pyarrow.parquet, or None when it is not installed. """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow
+
+## serializes the output of the pipeline threads
+_printLock = threading.Lock()
+
+def printLine(line):
+    """ Print "line" whole, so that the lines printed by concurrent threads are never mixed. """
+    with _printLock:
+        sys.stdout.write(line + "\n")
+
+## the columns of the ImageEval table in the order they are always inserted
+IMAGE_EVAL_COLUMNS = ('project', 'subject', 'session', 'seriesnumber', 'scantype',
+                      'overallqaassessment', 'normalvariants', 'lesions', 'snr', 'cnr',
+                      'fullbraincoverage', 'misalignment', 'swapwraparound', 'ghostingmotion',
+                      'inhomogeneity', 'susceptibilitymetal', 'flowartifact', 'truncationartifact',
+                      'evaluator', 'imagefile', 'freeformnotes', 'evaluationcompleted', 'date',
+                      'time', 'xnatSubjectID', 'xnatImageReviewLabel', 'xnatImageReviewID',
+                      'file_exists')
+
+## version of the ImageEvals.db schema, kept in "PRAGMA user_version"
+SCHEMA_VERSION = 1
+## status columns of the SyncState table
+SYNC_STATE_STATUS_COLUMNS = [('status', "TEXT NOT NULL DEFAULT 'done'"), ('error', 'TEXT'),
+                             ('attempts', 'INTEGER NOT NULL DEFAULT 0')]
+## SQLite type of the ImageEval columns that are not TEXT
+IMAGE_EVAL_TYPES = {'seriesnumber': 'INTEGER', 'overallqaassessment': 'INTEGER',
+                    'file_exists': 'INTEGER NOT NULL DEFAULT 0'}
+## the ScoreHistogram table counts the rows of each (project, scan type, overall QA
+## assessment score) of ImageEval, the triggers keep it up to date as ImageEval changes.
+## The ON CONFLICT clause of the statement that fires a trigger overrides the ones in
+## the trigger (ImageEvalWriter uses INSERT OR REPLACE), so the triggers use none.
+_SCORE_MATCH = "project = {0}.project AND scantype = {0}.scantype AND score = {0}.overallqaassessment"
+_SCORE_ADD = ("INSERT INTO ScoreHistogram SELECT NEW.project, NEW.scantype, NEW.overallqaassessment, 0 "
+              "WHERE NEW.project IS NOT NULL AND NEW.scantype IS NOT NULL AND NEW.overallqaassessment IS NOT NULL "
+              "AND NOT EXISTS (SELECT 1 FROM ScoreHistogram WHERE " + _SCORE_MATCH.format("NEW") + "); "
+              "UPDATE ScoreHistogram SET count = count + 1 WHERE " + _SCORE_MATCH.format("NEW") + "; ")
+_SCORE_REMOVE = ("UPDATE ScoreHistogram SET count = count - 1 WHERE " + _SCORE_MATCH.format("OLD") + "; "
+                 "DELETE FROM ScoreHistogram WHERE " + _SCORE_MATCH.format("OLD") + " AND count <= 0; ")
+SCORE_HISTOGRAM_SQL = [
+    "CREATE TABLE IF NOT EXISTS ScoreHistogram(project TEXT NOT NULL, scantype TEXT NOT NULL, "
+    "score INTEGER NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (project, scantype, score));",
+    "CREATE TRIGGER IF NOT EXISTS ImageEval_score_insert AFTER INSERT ON ImageEval BEGIN " + _SCORE_ADD + "END;",
+    "CREATE TRIGGER IF NOT EXISTS ImageEval_score_delete AFTER DELETE ON ImageEval BEGIN " + _SCORE_REMOVE + "END;",
+    "CREATE TRIGGER IF NOT EXISTS ImageEval_score_update AFTER UPDATE OF project, scantype, overallqaassessment "
+    "ON ImageEval BEGIN " + _SCORE_REMOVE + _SCORE_ADD + "END;"]
+SCORE_HISTOGRAM_TRIGGERS = ['ImageEval_score_insert', 'ImageEval_score_delete', 'ImageEval_score_update']
+## rebuilds ScoreHistogram from ImageEval, for a table that was written without the triggers
+SCORE_HISTOGRAM_FILL_SQL = [
+    "DELETE FROM ScoreHistogram;",
+    "INSERT INTO ScoreHistogram SELECT project, scantype, overallqaassessment, COUNT(*) FROM ImageEval "
+    "WHERE project IS NOT NULL AND scantype IS NOT NULL AND overallqaassessment IS NOT NULL "
+    "GROUP BY project, scantype, overallqaassessment;"]
+## conditions of iterExperiments() on an ExperimentList row "e" and its SyncState "s" (NULL when there is none)
+UNFINISHED_EXPERIMENTS = "s.status IS NOT 'done' OR s.lastmodified IS NOT e.lastmodified"
+FAILED_EXPERIMENTS = "s.status = 'failed'"
+## prefix given to the image files that were missing in schema version 0
+MISSING_FILE_PREFIX = "File path is not in the file system: "
+
+## names of the "phd:field" elements of an Image Eval XML file
+REVIEW_FIELDS = ('Overall QA Assessment', 'Normal Variants', 'Lesions', 'SNR', 'CNR',
+                 'Full Brain Coverage', 'Misalignment', 'Swap / Wrap Around', 'Ghosting / Motion',
+                 'Inhomogeneity', 'Susceptibility / Metal', 'Flow Artifact', 'Truncation Artifact',
+                 'Evaluator', 'Image File', 'Free Form Notes', 'Evaluation Completed')
+
+## ImageEval columns that the XNAT experiment listing can return directly, with the
+## XNAT search column requested for each one
+LISTING_COLUMNS = [('date', 'date'), ('time', 'time'),
+                   ('seriesnumber', 'phd:imageReviewData/series_number')]
+LISTING_COLUMNS += [(name.replace(' ','').replace('/','').lower(),
+                     'phd:imageReviewData/fields/field[name={0}]/field'.format(name)) for name in REVIEW_FIELDS]
+
+## one parsed Image Eval, its fields are the ImageEval columns so it can be inserted as is
+ImageEvalRecord = collections.namedtuple('ImageEvalRecord', IMAGE_EVAL_COLUMNS)
 
 class ParseXMLFilesAndFillDB():
     
-    def __init__(self):
+    def __init__(self, xnatURL = "https://www.predict-hd.net/xnat", workers = 8,
+                 retries = 3, timeout = 60, incremental = False, cacheDir = 'xnat_cache',
+                 cacheSize = 1024 * 1024 ** 2, offline = False, batchSize = 500,
+                 commitSize = 5000, bulk = True, pageSize = 5000, dirCacheFile = None,
+                 fetchSize = 1000, gzipOutput = False, columnar = False, parseProcesses = 0,
+                 queueSize = 64, timer = None, imageRoot = "/paulsen/MRx", username = None,
+                 pword = None, resume = False, retryPasses = 1, maxInFlight = 0):
         self.dbFileName = 'ImageEvals.db'
+        self.xnatURL = xnatURL
+        self.workers = workers
+        self.retries = retries
+        self.timeout = timeout
+        self.incremental = incremental
+        self.resume = resume
+        self.retryPasses = retryPasses
+        self.offline = offline
+        self.batchSize = batchSize
+        self.commitSize = commitSize
+        self.bulk = bulk
+        self.pageSize = pageSize
+        self.fetchSize = fetchSize
+        self.gzipOutput = gzipOutput
+        self.columnar = columnar
+        self.parseProcesses = parseProcesses
+        self.queueSize = queueSize
+        self.maxInFlight = maxInFlight
+        self.pipelineReport = None
+        self.imageRoot = imageRoot
+        self.username = username
+        self.pword = pword
+        self.timer = timer or PhaseTimer()
+        self._con = None
+        self.cache = None
+        if cacheDir is not None:
+            self.cache = XMLCache(cacheDir, cacheSize)
+        self.fetcher = None
+        self.fileIndex = ImageFileIndex(cacheFile = dirCacheFile, timer = self.timer)
+        ## position of each column in the experiment list, updated from its header line
+        self._expColumns = {'phd:imagereviewdata/id': 0, 'phd:imagereviewdata/label': 1,
+                            'xnat:subjectdata/id': 2, 'project': 3, 'uri': 4}
+        self._listingHeader = None
+        self._listingComplete = False
         
     def main(self):
-        expList = self.getExperimentsList()
-        self.createDataBase()        
-        self.fillDBFromXMLs(expList)
-        self.printDBtoCSVfile()
-        self.printAutoWorkupCSV()
-        self.printImagesNotInFileSystem()
+        self.updateDataBase()
+        self.printReports()
+        
+    def updateDataBase(self):
+        """
+        Build the database from XNAT, or bring it up to date in incremental
+        mode.  The experiment list is streamed into the database page by
+        page before any Image Eval is loaded, and the Image Evals are then
+        read back from there, so the memory used does not grow with the
+        number of experiments.  SyncState records each experiment as it is
+        loaded or fails, so a run that stops part way can be continued with
+        "resume": the saved list is used and the loaded experiments are
+        skipped.  Experiments that failed are retried "retryPasses" times,
+        and the ones that still fail are left for the next "resume" run.
+        """
+        listed = False
+        if self.resume:
+            with self.timer.measure('createDataBase'):
+                self.createDataBase(keepExisting = True)
+            listed = self.loadListingHeader()
+            if not listed:
+                print "WARNING: {0} has no saved experiment list, the sync starts from the beginning".format(
+                    self.dbFileName)
+            else:
+                self.connectToXNAT()
+                self._deleteUnloadedRows()
+                print "Resuming the sync: {0} of {1} experiments left to load".format(
+                    self.countExperiments(UNFINISHED_EXPERIMENTS), self.countExperiments())
+        if not listed:
+            with self.timer.measure('getExperimentsList'):
+                expList = self.getExperimentsList()
+            with self.timer.measure('createDataBase'):
+                self.createDataBase(keepExisting = self.incremental)
+            with self.timer.measure('saveExperimentsList'):
+                self.saveExperimentsList(expList)
+            if self.incremental:
+                with self.timer.measure('syncDataBase'):
+                    self.syncDataBase()
+        with self.timer.measure('fillDBFromXMLs'):
+            ## only a database that was just created is bulk loaded
+            self.fillDBFromXMLs(self.iterExperiments(UNFINISHED_EXPERIMENTS),
+                                bulkLoad = not listed and not self.incremental)
+        for retry in range(self.retryPasses):
+            failed = self.countExperiments(FAILED_EXPERIMENTS)
+            if not failed:
+                break
+            print "Retrying {0} experiments that could not be loaded".format(failed)
+            with self.timer.measure('retryFailedExperiments'):
+                self.fillDBFromXMLs(self.iterExperiments(FAILED_EXPERIMENTS))
+        self.printFailures()
+        
+    def connectToXNAT(self):
+        """ Ask for the XNAT user name and password, unless they were given, and create the XNATFetcher. """
+        if self.offline:
+            self.username, self.pword = None, None
+        elif self.username is None:
+            opener = urllib.FancyURLopener({})
+            self.username, self.pword = opener.prompt_user_passwd(self.xnatURL.split("://")[-1], "XNAT")
+        self.fetcher = XNATFetcher(self.xnatURL, self.username, self.pword, retries = self.retries,
+                                   timeout = self.timeout, cache = self.cache, offline = self.offline,
+                                   timer = self.timer)
         
     def getExperimentsList(self):
         """
-        Create a secure connection to XNAT using "urllib".  Then the
+        Create a secure connection to XNAT using "urllib", asking for the
+        user name and password unless they were given.  Then the
         "phd:imagereviewdata/id", "phd:imagereviewdata/label",
         "xnat:subjectdata/id", "project", and "URI" are retrieved for each
-        image that has been evaluated. This information is saved to a temporary
-        file called "experiments_tmp.csv".
+        image that has been evaluated, along with the "insert_date" and
+        "last_modified" dates used by the incremental sync.  In bulk mode
+        the Image Eval fields in LISTING_COLUMNS are requested too, so most
+        Image Eval XML files never need to be downloaded.  Returns an
+        iterator over the rows of the listing, which is downloaded
+        "pageSize" experiments at a time as the rows are consumed.
         
-        Here is an example of the first 5 lines of "experiments_tmp.csv":
+        Here is an example of the first 5 lines of the listing:
         
         "phd:imagereviewdata/id","phd:imagereviewdata/label","xnat:subjectdata/id","project","URI"
         "PREDICTHD_E11437","11349_3_IR","PREDICTHD_S01033","PHD_177","/data/experiments/PREDICTHD_E11437"
@@ -55,459 +274,1968 @@ class ParseXMLFilesAndFillDB():
         "PREDICTHD_E11521","10158_2_IR","PREDICTHD_S00202","PHD_041","/data/experiments/PREDICTHD_E11521"
     
         """
-        RESTurl = "www.predict-hd.net/xnat/REST/experiments?xsiType="
-        RESTurl += "phd:imageReviewData&format=csv&columns=project,phd:image"
-        RESTurl += "ReviewData/label,xnat:subjectData/ID"
-        opener = urllib.FancyURLopener({})
-        self.username, self.pword = opener.prompt_user_passwd("www.predict-hd.net/xnat", "XNAT")
-        url = "https://{0}:{1}@{2}".format(self.username, self.pword, RESTurl)
-        info = urllib.urlopen(url)
-        exp_string = info.read()
-        exp_list = exp_string.strip().replace("\"","").split('\n')
-        return exp_list[1:] ## header line not needed in the returned list
+        columns = "project,phd:imageReviewData/label,xnat:subjectData/ID,insert_date,last_modified"
+        self.connectToXNAT()
+        if not self.bulk:
+            return self._getListing(columns)
+        try:
+            return self._getListing(",".join([columns] + [xnat_col for (col, xnat_col) in LISTING_COLUMNS]))
+        except IOError as error:
+            if getattr(error, 'status', 500) >= 500:
+                raise
+            print "WARNING: XNAT rejected the Image Eval field columns (HTTP {0}), every Image Eval XML file will be downloaded".format(error.status)
+            return self._getListing(columns)
         
-    def createDataBase(self):
+    def _getListing(self, columns):
+        """
+        Returns an iterator over the rows of the experiment listing with the
+        given columns.  The first page is downloaded before returning, so
+        that a rejected request raises here, and each of the next ones when
+        the rows of the previous page have been consumed.
+        """
+        RESTpath = "/REST/experiments?xsiType=phd:imageReviewData&format=csv&columns="
+        RESTpath += urllib.quote(columns, safe = ',:/')
+        pages = self._iterListingPages(RESTpath)
+        first_page = next(pages, [])
+        return itertools.chain.from_iterable(itertools.chain([first_page], pages))
+        
+    def _iterListingPages(self, RESTpath):
+        """
+        Yields the rows of the experiment listing "pageSize" experiments
+        (one request) at a time, parsed with the csv module.  The pages are
+        requested sorted by experiment ID, so that no experiment moves from
+        one page to another between requests and is missed (the incremental
+        sync would then delete it).  Only one page is held in memory, unless
+        "pageSize" is 0 or the server ignores the paging parameters and
+        returns the whole listing at once.
+        """
+        first_row = None
+        offset = 0
+        while True:
+            page_path = RESTpath
+            if self.pageSize > 0:
+                page_path += "&sortBy=ID&offset={0}&limit={1}".format(offset, self.pageSize)
+            start = time.time()
+            page = self.fetcher.fetch(page_path)
+            self.timer.record('listing_page', time.time() - start, len(page))
+            reader = csv.reader(StringIO.StringIO(page))
+            page = None
+            header = next(reader, None)
+            if header is not None:
+                self._setListingHeader(header)
+            rows = [row for row in reader if row]
+            if header is None or not rows or rows[0] == first_row:
+                return ## an empty page, or a server that ignores the paging parameters
+            yield rows
+            first_row = rows[0]
+            if self.pageSize <= 0 or len(rows) != self.pageSize:
+                return
+            offset += len(rows)
+        
+    def _setListingHeader(self, header):
+        """
+        Set the position of each column of the experiment listing from its
+        header line.  The names are stripped, so a stray "\r" of a CRLF
+        listing does not hide the last column.
+        """
+        self._listingHeader = header
+        self._expColumns = dict((name.strip().lower(), index) for (index, name) in enumerate(header))
+        self._listingComplete = True
+        for (col, xnat_col) in LISTING_COLUMNS:
+            if xnat_col.lower() not in self._expColumns:
+                self._listingComplete = False
+                
+    def saveExperimentsList(self, expList):
+        """
+        Save the rows of the experiment list as they are downloaded, with
+        the Image Eval ID and modification date of each one, in the
+        ExperimentList table, and then its header line in CrawlState.  The
+        syncs and a "resume" run read the experiments from there (see
+        iterExperiments).
+        """
+        con = self.getConnection()
+        con.execute("DELETE FROM ExperimentList;")
+        con.execute("DELETE FROM CrawlState WHERE name = 'listingHeader';")
+        con.executemany("INSERT INTO ExperimentList (position, xnatImageReviewID, lastmodified, scan_info) "
+                        "VALUES (?, ?, ?, ?);",
+                        ((position,) + self._getSyncInfo(scan_info) + (self._encodeScanInfo(scan_info),)
+                         for (position, scan_info) in enumerate(expList)))
+        con.execute("INSERT OR REPLACE INTO CrawlState VALUES ('listingHeader', ?);",
+                    (json.dumps(self._listingHeader),))
+        con.commit()
+        
+    def loadListingHeader(self):
+        """ Read the header line saved by saveExperimentsList, returns False if there is none. """
+        header = self.getConnection().execute("SELECT value FROM CrawlState WHERE name = 'listingHeader';").fetchone()
+        if header is None or header[0] is None or json.loads(header[0]) is None:
+            return False
+        self._setListingHeader(self._decodeJSONRow(header[0]))
+        return True
+    
+    def _decodeJSONRow(self, values):
+        return [value.encode('utf-8') for value in json.loads(values)]
+    
+    def _encodeScanInfo(self, scan_info):
+        """ A row of the experiment list as a line of CSV, stored as a BLOB so that any bytes are kept. """
+        line = StringIO.StringIO()
+        csv.writer(line).writerow(scan_info)
+        return buffer(line.getvalue())
+    
+    def iterExperiments(self, condition = None):
+        """
+        Yields the rows of the saved experiment list in order, or only the
+        ones that meet "condition" (UNFINISHED_EXPERIMENTS or
+        FAILED_EXPERIMENTS).  They are read "fetchSize" at a time with a
+        connection of their own, so the write stage can use the main one
+        meanwhile.
+        """
+        query = ("SELECT e.position, e.scan_info FROM ExperimentList e LEFT JOIN SyncState s "
+                 "ON s.xnatImageReviewID = e.xnatImageReviewID WHERE e.position > ? {0} "
+                 "ORDER BY e.position LIMIT ?;").format("" if condition is None else "AND ({0})".format(condition))
+        con = lite.connect(self.dbFileName)
+        try:
+            position = -1
+            while True:
+                rows = con.execute(query, (position, self.fetchSize)).fetchall()
+                if not rows:
+                    return
+                position = rows[-1][0]
+                for scan_info in csv.reader(str(scan_info) for (row_position, scan_info) in rows):
+                    yield scan_info
+        finally:
+            con.close()
+            
+    def countExperiments(self, condition = None):
+        """ Returns the number of experiments of the saved list, or of the ones that meet "condition". """
+        return self.getConnection().execute(
+            "SELECT COUNT(*) FROM ExperimentList e LEFT JOIN SyncState s ON s.xnatImageReviewID = e.xnatImageReviewID "
+            "WHERE {0};".format(condition or "1")).fetchone()[0]
+    
+    def _deleteUnloadedRows(self):
+        """ Delete the ImageEval rows of the experiments that are not loaded, left by an interrupted run. """
+        con = self.getConnection()
+        con.execute("DELETE FROM ImageEval WHERE xnatImageReviewID NOT IN "
+                    "(SELECT xnatImageReviewID FROM SyncState WHERE status = 'done');")
+        con.commit()
+    
+    def printFailures(self):
+        """ Print the experiments that could not be loaded, and why. """
+        con = self.getConnection()
+        failed = con.execute("SELECT COUNT(*) FROM SyncState WHERE status = 'failed';").fetchone()[0]
+        if not failed:
+            return
+        print "WARNING: {0} experiments could not be loaded, run again with --resume to retry them".format(failed)
+        for (imageReviewID, attempts, error) in con.execute(
+            "SELECT xnatImageReviewID, attempts, error FROM SyncState WHERE status = 'failed' "
+            "ORDER BY xnatImageReviewID LIMIT 20;"):
+            print "    {0} ({1} attempts): {2}".format(imageReviewID, attempts, error)
+        if failed > 20:
+            print "    ..."
+        
+    def createDataBase(self, keepExisting = False):
         """
         Create the ImageEval SQLite database that will contain all of
-        the information parsed from the Image Eval XML files.            
+        the information parsed from the Image Eval XML files.  The SyncState
+        table records the XNAT modification date of every experiment stored
+        in ImageEval, or the error of an experiment that could not be
+        loaded, and the number of attempts.  ExperimentList and CrawlState
+        keep the experiment list of the last sync.  ScoreHistogram keeps the
+        score counts the boxplots are made from (see SCORE_HISTOGRAM_SQL),
+        and is refilled from ImageEval when its triggers are missing: after
+        a migration or a bulk load that was interrupted.
+        If "keepExisting" is True an existing database is updated in place
+        instead of being rebuilt, and is first migrated to the current
+        SCHEMA_VERSION.
         """   
-        ## column titles and types for the ImageEval SQLite database
-        dbColTypes =  "project TEXT, subject TEXT, session TEST, seriesnumber INTEGER, scantype TEXT, "
-        dbColTypes += "overallqaassessment INTEGER, normalvariants TEXT, lesions TEXT, snr TEXT, cnr "
-        dbColTypes += "TEXT, fullbraincoverage TEXT, misalignment TEXT, swapwraparound TEXT, "
-        dbColTypes += "ghostingmotion TEXT, inhomogeneity TEXT, susceptibilitymetal TEXT, "
-        dbColTypes += "flowartifact TEXT, truncationartifact TEXT, evaluator TEXT, imagefile "
-        dbColTypes += "TEXT, freeformnotes TEXT, evaluationcompleted TEXT, date TEXT, time TEXT, "
-        dbColTypes += "xnatSubjectID TEXT, xnatImageReviewLabel TEXT, xnatImageReviewID TEXT"
-
-        if os.path.exists(self.dbFileName):
+        if os.path.exists(self.dbFileName) and not keepExisting:
+            self.closeDataBase()
             os.remove(self.dbFileName)
-        con = lite.connect(self.dbFileName)
+        con = self.getConnection()
         dbCur = con.cursor()
-        dbCur.execute("CREATE TABLE ImageEval({0});".format(dbColTypes))
+        self.migrateDataBase(con)
+        refillHistogram = dbCur.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name = ?;",
+                                        (SCORE_HISTOGRAM_TRIGGERS[0],)).fetchone()[0] == 0
+        dbCur.execute("CREATE TABLE IF NOT EXISTS ImageEval({0});".format(self._getImageEvalColTypes()))
+        dbCur.execute("CREATE INDEX IF NOT EXISTS ImageEval_project_scantype ON ImageEval (project, scantype);")
+        ## covers the ORDER BY and the columns of the session reports, so they are read
+        ## from the index in order instead of a row lookup per result
+        dbCur.execute("CREATE INDEX IF NOT EXISTS ImageEval_project_subject_session ON ImageEval "
+                      "(project, subject, session, scantype, overallqaassessment DESC, file_exists, imagefile);")
+        dbCur.execute("CREATE TABLE IF NOT EXISTS SyncState(xnatImageReviewID TEXT PRIMARY KEY, lastmodified TEXT, "
+                      "{0});".format(", ".join(["{0} {1}".format(col, colType)
+                                                for (col, colType) in SYNC_STATE_STATUS_COLUMNS])))
+        dbCur.execute("CREATE TABLE IF NOT EXISTS ExperimentList(position INTEGER PRIMARY KEY, "
+                      "xnatImageReviewID TEXT, scan_info TEXT, lastmodified TEXT);")
+        dbCur.execute("CREATE INDEX IF NOT EXISTS ExperimentList_xnatImageReviewID "
+                      "ON ExperimentList (xnatImageReviewID);")
+        dbCur.execute("CREATE TABLE IF NOT EXISTS CrawlState(name TEXT PRIMARY KEY, value TEXT);")
+        for statement in SCORE_HISTOGRAM_SQL:
+            dbCur.execute(statement)
+        if refillHistogram:
+            for statement in SCORE_HISTOGRAM_FILL_SQL:
+                dbCur.execute(statement)
+        dbCur.execute("PRAGMA user_version = {0};".format(SCHEMA_VERSION))
         dbCur.close()
-            
-    def fillDBFromXMLs(self, expList):
-        con = lite.connect(self.dbFileName)
-        dbCur = con.cursor()
+        con.commit()
         
-        for line in expList:
-            (xnatSubjectID, project, URI) = self._getScanInfo(line)
-            xmlString = self.getXMLstring(URI)            
-            myResult=ParseToFields(xmlString)
-            xmlString = None
-            imagefile = myResult._fieldDict['imagefile']
-            (subject, session, scan_type) = self._findSubjectSessionAndScanType(imagefile, project)
-            myResult._fieldDict['subject'] = subject
-            myResult._fieldDict['session'] = session            
-            myResult._fieldDict['scantype'] = scan_type
-            myResult._fieldDict['xnatSubjectID']= xnatSubjectID
-            myResult._fieldDict['date'] = myResult._date
-            myResult._fieldDict['time'] = myResult._time
-            myResult._fieldDict['project'] = myResult._project
-            myResult._fieldDict['xnatImageReviewLabel'] = myResult._label
-            myResult._fieldDict['xnatImageReviewID'] = myResult._imageReviewID
-            myResult._fieldDict['seriesnumber'] = myResult._series_number
-            #  forcing image file name to follow mandated format
-            imagefile = os.path.join("/paulsen", "MRx", myResult._project, subject, session, "ANONRAW",
-                                      subject + "_" + session + "_" + scan_type + "_" + myResult._series_number + ".nii.gz")
-            PDT2_scan_types = ['PDT2-15', 'PD-15', 'T2-15']
-            if scan_type not in PDT2_scan_types:
-                if self.checkIfImageFileExists(imagefile):
-                    myResult._fieldDict['imagefile'] = imagefile
-                else:
-                    myResult._fieldDict['imagefile'] = "File path is not in the file system: {0}".format(imagefile)
-                SQLiteCommand = self._getSQLiteCommand(myResult._fieldDict)
-                myResult = None
-                dbCur.execute(SQLiteCommand)
-                SQLiteCommand = None        
+    def migrateDataBase(self, con):
+        """
+        Migrate a database of schema version 0, which only has an ImageEval
+        table (no key, scores stored as text, missing image files marked with
+        MISSING_FILE_PREFIX), to the current schema.  The other tables are
+        created by createDataBase, which also fills ScoreHistogram from the
+        migrated rows.
+        """
+        version = con.execute("PRAGMA user_version;").fetchone()[0]
+        tables = set(name for (name,) in con.execute("SELECT name FROM sqlite_master WHERE type = 'table';"))
+        if version >= SCHEMA_VERSION or 'ImageEval' not in tables:
+            return
+        print "Migrating {0} from schema version {1} to {2}".format(self.dbFileName, version, SCHEMA_VERSION)
+        self._migrateImageEvalTable(con, version)
+        con.commit()
+        
+    def _migrateImageEvalTable(self, con, version):
+        old_columns = [row[1] for row in con.execute("PRAGMA table_info(ImageEval);")]
+        new_values = list()
+        for col in IMAGE_EVAL_COLUMNS:
+            if col == 'file_exists':
+                new_values.append("CASE WHEN substr(imagefile, 1, {0}) = '{1}' THEN 0 ELSE 1 END".format(
+                    len(MISSING_FILE_PREFIX), MISSING_FILE_PREFIX))
+            elif col not in old_columns:
+                new_values.append("NULL")
+            elif col == 'imagefile':
+                new_values.append("CASE WHEN substr(imagefile, 1, {0}) = '{1}' THEN substr(imagefile, {2}) "
+                                  "ELSE imagefile END".format(len(MISSING_FILE_PREFIX), MISSING_FILE_PREFIX,
+                                                              len(MISSING_FILE_PREFIX) + 1))
+            elif IMAGE_EVAL_TYPES.get(col) == 'INTEGER':
+                new_values.append("CASE WHEN trim({0}) GLOB '[0-9]*' THEN CAST(trim({0}) AS INTEGER) END".format(col))
             else:
-                SQLite_command_dict = self.checkScanTypesAndImagefile(scan_type, imagefile, 
-                                                                      myResult._fieldDict)
-                myResult = None
-                commands_list = SQLite_command_dict.values()
-                for command in commands_list:
-                    dbCur.execute(command)
-                    command = None
+                new_values.append(col)
+        con.execute("ALTER TABLE ImageEval RENAME TO ImageEval_v{0};".format(version))
+        con.execute("CREATE TABLE ImageEval({0});".format(self._getImageEvalColTypes()))
+        con.execute("INSERT OR REPLACE INTO ImageEval ({0}) SELECT {1} FROM ImageEval_v{2};".format(
+            ", ".join(IMAGE_EVAL_COLUMNS), ", ".join(new_values), version))
+        con.execute("DROP TABLE ImageEval_v{0};".format(version))
+        
+    def _getImageEvalColTypes(self):
+        """ Returns the column titles, types and primary key of the ImageEval table. """
+        dbColTypes = ", ".join(["{0} {1}".format(col, IMAGE_EVAL_TYPES.get(col, 'TEXT'))
+                                for col in IMAGE_EVAL_COLUMNS])
+        return dbColTypes + ", PRIMARY KEY (xnatImageReviewID, scantype)"
 
-            con.commit()
+    def syncDataBase(self):
+        """
+        Compare the experiment list saved from XNAT with the SyncState table,
+        in the database so that neither is held in memory.  Rows of
+        experiments that were removed from XNAT, or whose modification date
+        changed, are deleted from the database.  The experiments that need to
+        be loaded are then the UNFINISHED_EXPERIMENTS of iterExperiments().
+        """
+        con = self.getConnection()
+        dbCur = con.cursor()
+        listed = dbCur.execute("SELECT COUNT(*) FROM ExperimentList;").fetchone()[0]
+        (unchanged, changed) = dbCur.execute(
+            "SELECT TOTAL(s.lastmodified IS e.lastmodified), TOTAL(s.lastmodified IS NOT e.lastmodified) "
+            "FROM ExperimentList e JOIN SyncState s ON s.xnatImageReviewID = e.xnatImageReviewID "
+            "WHERE s.status = 'done';").fetchone()
+        removed = dbCur.execute("DELETE FROM SyncState WHERE xnatImageReviewID NOT IN "
+                                "(SELECT xnatImageReviewID FROM ExperimentList);").rowcount
+        dbCur.execute("DELETE FROM SyncState WHERE status = 'done' AND lastmodified IS NOT "
+                      "(SELECT e.lastmodified FROM ExperimentList e "
+                      "WHERE e.xnatImageReviewID = SyncState.xnatImageReviewID);")
         dbCur.close()
+        ## also drops rows left behind by an interrupted or pre-SyncState run
+        self._deleteUnloadedRows()
+        print "Incremental sync: {0} new, {1} changed, {2} removed, {3} unchanged experiments".format(
+            listed - int(changed) - int(unchanged), int(changed), removed, int(unchanged))
+            
+    def fillDBFromXMLs(self, expList, bulkLoad = False):
+        """
+        Load the Image Evals of "expList", an iterable of experiment listing
+        rows read "fetchSize" at a time, into the database with a pipeline
+        of stages connected by bounded queues (see PipelineStage):
+            fetch   - "workers" threads download the Image Eval XML files
+            parse   - the XML files are parsed by a pool of "parseProcesses"
+                      processes, or by one thread when it is 0
+            resolve - "workers" threads find the image files in the file system
+            write   - one thread writes the rows with the database connection
+        Image Evals whose fields are all in the experiment listing skip the
+        fetch and parse stages.  An experiment that fails in any stage is
+        passed to the write stage with its error, which records it in
+        SyncState.  With "maxInFlight" no more than that many experiments
+        are between the listing and the write stage at once.  The counters
+        of every stage are printed at the end and kept in "pipelineReport".
+        "bulkLoad" is for an empty database, see ImageEvalWriter.
+        """
+        writer = ImageEvalWriter(self.getConnection(), batchSize = self.batchSize, commitSize = self.commitSize,
+                                 bulkLoad = bulkLoad, timer = self.timer)
+        parser = ParseToRecord()
+        parsePool = None
+        if self.parseProcesses > 0:
+            ## started before any pipeline thread so that no lock is held when it forks
+            parsePool = multiprocessing.Pool(self.parseProcesses)
+        inFlight = None
+        if self.maxInFlight > 0:
+            inFlight = threading.BoundedSemaphore(self.maxInFlight)
+            
+        def fail(scan_info, stage, error):
+            write_stage.put((None, self._getSyncInfo(scan_info), "{0}: {1}".format(stage, error)))
+            
+        def fetch(scan_info):
+            URI = self._getScanInfo(scan_info)[2]
+            try:
+                start = time.time()
+                xmlString = self.fetcher.fetch(self._getXMLpath(URI))
+                ## the bytes downloaded are counted once, by the xnat_request phase
+                self.timer.record('fetch_xml', time.time() - start)
+                return [(scan_info, xmlString)]
+            except (IOError, httplib.HTTPException) as error:
+                printLine("ERROR: Could not download Image Eval XML file from {0}: {1}".format(URI, error))
+                fail(scan_info, 'fetch', error)
+                return None
+            except Exception as error:
+                printLine("ERROR: Could not download Image Eval XML file from {0}: {1!r}".format(URI, error))
+                fail(scan_info, 'fetch', repr(error))
+                return None
+            
+        def parse(item):
+            (scan_info, xmlString) = item
+            URI = self._getScanInfo(scan_info)[2]
+            printLine("Parsing Image Eval XML file from {0}".format(URI))
+            try:
+                with self.timer.measure('parse_xml'):
+                    if parsePool is None:
+                        return [(scan_info, parseImageEvalXML(xmlString), None)]
+                    return [(scan_info, parsePool.apply(parseImageEvalXML, (xmlString,)), None)]
+            except ValueError as error:
+                printLine("ERROR: Could not parse Image Eval XML file from {0}: {1}".format(URI, error))
+                fail(scan_info, 'parse', error)
+                return None
+            except Exception as error:
+                printLine("ERROR: Could not parse Image Eval XML file from {0}: {1!r}".format(URI, error))
+                fail(scan_info, 'parse', repr(error))
+                return None
+        
+        def resolve(item):
+            (scan_info, record, names) = item
+            try:
+                with self.timer.measure('resolve_image_files'):
+                    (record, imagefile) = self._getImageInfo(record, scan_info, names)
+                    return [(self._resolveRows(record, imagefile), self._getSyncInfo(scan_info), None)]
+            except Exception as error:
+                printLine("ERROR: Could not find the image files of {0}: {1!r}".format(self._getScanInfo(scan_info)[2], error))
+                fail(scan_info, 'resolve', repr(error))
+                return None
+        
+        def write(item):
+            ## every experiment ends here exactly once, loaded or failed
+            (rows, syncInfo, error) = item
+            try:
+                if error is not None:
+                    writer.addFailure(syncInfo, error)
+                    return
+                for row in rows:
+                    writer.addRow(row)
+                writer.addSyncState(syncInfo)
+            finally:
+                if inFlight is not None:
+                    inFlight.release()
+                    
+        def put(stage, item):
+            if inFlight is not None:
+                inFlight.acquire()
+            stage.put(item)
+            
+        stages = [PipelineStage('fetch', fetch, workers = self.workers, queueSize = self.queueSize,
+                                finish = self.fetcher._closeConnection),
+                  PipelineStage('parse', parse, workers = max(1, self.parseProcesses), queueSize = self.queueSize),
+                  ## fed by the parse stage and by the listing
+                  PipelineStage('resolve', resolve, workers = self.workers, queueSize = self.queueSize, producers = 2),
+                  PipelineStage('write', write, queueSize = self.queueSize, finish = writer.close)]
+        (fetch_stage, parse_stage, resolve_stage, write_stage) = stages
+        for (stage, next_stage) in zip(stages, stages[1:]):
+            stage.next = next_stage
+        for stage in stages:
+            stage.start()
+        (listed, queued) = (0, 0)
+        expList = iter(expList)
+        try:
+            while True:
+                chunk = list(itertools.islice(expList, self.fetchSize))
+                if not chunk:
+                    break
+                listing = list()
+                for scan_info in chunk:
+                    record = self._getRecordFromListing(scan_info, parser)
+                    if record is None:
+                        put(fetch_stage, scan_info)
+                        queued += 1
+                    else:
+                        listing.append((scan_info, record))
+                ## the image file names of the chunk are parsed at once, while its XML files download
+                with self.timer.measure('parse_listing_file_names'):
+                    names = self._getImageFileNames(listing)
+                for ((scan_info, record), record_names) in itertools.izip(listing, names):
+                    put(resolve_stage, (scan_info, record, record_names))
+                listed += len(listing)
+        finally:
+            fetch_stage.close()
+            resolve_stage.close()
+        for stage in stages:
+            stage.join()
+        ## the fetch stage passes on the XML files that were downloaded
+        print "{0} Image Evals loaded from the experiment listing, {1} of {2} Image Eval XML files downloaded".format(
+            listed, fetch_stage.itemsOut, queued)
+        if parsePool is not None:
+            parsePool.close()
+            parsePool.join()
+        self.fileIndex.save()
+        if self.cache is not None:
+            self.cache.flush()
+        self.pipelineReport = [stage.report() for stage in stages]
+        self.timer.sections['pipeline'] = self.pipelineReport
+        self.printPipelineReport()
+        if write_stage.errors:
+            raise RuntimeError("{0} Image Evals could not be written to {1}".format(write_stage.errors, self.dbFileName))
+        
+    def printPipelineReport(self):
+        """
+        Print the counters of the pipeline stages.  The stage that limits
+        the run is busy most of the time and has a full queue, while the
+        stages after it wait with empty queues.
+        """
+        print "{0:>8} {1:>7} {2:>8} {3:>8} {4:>6} {5:>9} {6:>6} {7:>10} {8:>9}".format(
+            'stage', 'workers', 'in', 'out', 'errors', 'items/s', 'busy', 'mean queue', 'max queue')
+        for report in self.pipelineReport:
+            print "{stage:>8} {workers:>7} {in:>8} {out:>8} {errors:>6} {per_second:>9.1f} {busy:>6.0%} {mean_queue:>10.1f} {max_queue:>9}".format(**report)
+        
+    def _getImageInfo(self, record, scan_info, names = None):
+        """
+        Returns the record of an Image Eval completed with its subject,
+        session, scan type and XNAT Subject ID, and the image file name it
+        must have.  "names" are the subject, session, scan type and image
+        file name already found by _getImageFileNames.
+        """
+        (xnatSubjectID, project, URI) = self._getScanInfo(scan_info)
+        if names is None:
+            (subject, session, scan_type) = self._findSubjectSessionAndScanType(record.imagefile, project)
+            #  forcing image file name to follow mandated format
+            imagefile = makeImageFile(self.imageRoot, record.project, subject, session, scan_type,
+                                      record.seriesnumber)
+        else:
+            (subject, session, scan_type, imagefile) = names
+        record = record._replace(subject = subject, session = session, scantype = scan_type,
+                                 xnatSubjectID = xnatSubjectID,
+                                 seriesnumber = self._toInteger(record.seriesnumber),
+                                 overallqaassessment = self._toInteger(record.overallqaassessment))
+        return record, imagefile
+        
+    def _getImageFileNames(self, items):
+        """
+        Returns the subject, session, scan type and forced image file name
+        of the image file of each (scan_info, record) item, parsed in one
+        batch (see imageEvalFileNames.parseImageFiles).
+        """
+        records = [record for (scan_info, record) in items]
+        names = parseImageFiles([record.imagefile for record in records],
+                                [self._getScanInfo(scan_info)[1] for (scan_info, record) in items],
+                                [record.project for record in records],
+                                [record.seriesnumber for record in records], self.imageRoot)
+        for (record, subject) in itertools.izip(records, names.subject):
+            if subject == NOT_FOUND[0]:
+                self._printInvalidImageFile(record.imagefile)
+        return itertools.izip(names.subject, names.session, names.scantype, names.imagefile)
+        
+    def _toInteger(self, value):
+        """ Returns the value of an INTEGER column, None when it is not a number. """
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+        
+    def _resolveRows(self, record, imagefile):
+        """ Check the image files of an Image Eval and return its ImageEval rows. """
+        scan_type = record.scantype
+        if scan_type not in PDT2_SCAN_TYPES:
+            return [record._replace(imagefile = imagefile,
+                                    file_exists = self.checkIfImageFileExists(imagefile))]
+        else:
+            rows_dict = self.checkScanTypesAndImagefile(scan_type, imagefile, record)
+            return rows_dict.values()
         
     def checkIfImageFileExists(self, imagefile):
-        if os.path.exists(imagefile):
+        if self.fileIndex.exists(imagefile):
             return 1
         else:
             return 0
         
-    def checkScanTypesAndImagefile(self, scan_type, imagefile, fieldDict):
-        SQLite_command_dict = dict()
-        if scan_type == 'PDT2-15':
-            PD_imagefile = imagefile.replace('_PDT2-15_', '_PD-15_')
-            T2_imagefile = imagefile.replace('_PDT2-15_', '_T2-15_')
-        elif scan_type == 'PD-15':
-            PD_imagefile = imagefile
-            T2_imagefile = imagefile.replace('_PD-15_', '_T2-15_')            
-        elif scan_type == 'T2-15':
-            PD_imagefile = imagefile.replace('_T2-15_', '_PD-15_')
-            T2_imagefile = imagefile
-        if os.path.exists(PD_imagefile):
-            fieldDict['scantype'] = 'PD-15'
-            fieldDict['imagefile'] = PD_imagefile
-            SQLite_command_dict['PD-15'] = self._getSQLiteCommand(fieldDict)
-        if os.path.exists(T2_imagefile):
-            fieldDict['scantype'] = 'T2-15'
-            fieldDict['imagefile'] = T2_imagefile
-            SQLite_command_dict['T2-15'] = self._getSQLiteCommand(fieldDict)
-        return SQLite_command_dict
-    
-    def _getScanInfo(self, line):
-        """ Returns the XNAT Subject ID and the URI for an Image Eval. """
-        scan_info = line.strip().split(',')
-        xnat_subject_ID = scan_info[2]
-        project = scan_info[3]
-        URI = scan_info[4]
+    def checkScanTypesAndImagefile(self, scan_type, imagefile, record):
+        rows_dict = dict()
+        (PD_imagefile, T2_imagefile) = getPDT2ImageFiles(scan_type, imagefile)
+        if self.fileIndex.exists(PD_imagefile):
+            rows_dict['PD-15'] = record._replace(scantype = 'PD-15', imagefile = PD_imagefile, file_exists = 1)
+        if self.fileIndex.exists(T2_imagefile):
+            rows_dict['T2-15'] = record._replace(scantype = 'T2-15', imagefile = T2_imagefile, file_exists = 1)
+        return rows_dict
+    
+    def _getScanInfo(self, scan_info):
+        """ Returns the XNAT Subject ID, the project and the URI for an Image Eval. """
+        xnat_subject_ID = scan_info[self._expColumns['xnat:subjectdata/id']]
+        project = scan_info[self._expColumns['project']]
+        URI = scan_info[self._expColumns['uri']]
         return xnat_subject_ID, project, URI
-                
-    def getXMLstring(self, URI):
+
+    def _getSyncInfo(self, scan_info):
         """
-        Copy the Image Eval XML information from XNAT.
-        Store it in the string "xmlString"
+        Returns the Image Eval ID and the XNAT modification date for an Image
+        Eval.  The insert date is used for experiments that were never modified.
         """
-        path = "www.predict-hd.net/xnat{0}?format=xml".format(URI)
-        url = "https://{0}:{1}@{2}".format(self.username, self.pword, path)
-        info = urllib.urlopen(url)
-        xml_string = info.read()
-        print "Parsing Image Eval XML file from {0}".format(path)
-        return xml_string
+        imageReviewID = scan_info[self._expColumns['phd:imagereviewdata/id']]
+        lastModified = ""
+        for column in ('last_modified', 'insert_date'):
+            if column in self._expColumns and scan_info[self._expColumns[column]]:
+                lastModified = scan_info[self._expColumns[column]]
+                break
+        return imageReviewID, lastModified
+
+    def _getRecordFromListing(self, scan_info, parser):
+        """
+        Returns the ImageEvalRecord of an Image Eval built from the columns of
+        the experiment listing, or None when its Image Eval XML file is needed.
+        The listing is read as UTF-8 bytes, the values are decoded to unicode
+        as the XML parser returns them, since sqlite3 rejects non-ASCII bytes.
+        """
+        if not self._listingComplete:
+            return None
+        values = dict()
+        for (col, xnat_col) in LISTING_COLUMNS:
+            values[col] = scan_info[self._expColumns[xnat_col.lower()]]
+        if not values['imagefile']:
+            return None
+        values['project'] = scan_info[self._expColumns['project']]
+        values['xnatImageReviewLabel'] = scan_info[self._expColumns['phd:imagereviewdata/label']]
+        values['xnatImageReviewID'] = scan_info[self._expColumns['phd:imagereviewdata/id']]
+        return parser.makeRecord(dict((col, value.decode('utf-8', 'replace')) for (col, value) in values.items()))
+                
+    def _getXMLpath(self, URI):
+        """ Returns the REST path of the Image Eval XML file for an experiment URI. """
+        return "{0}?format=xml".format(URI)
                 
     def _findSubjectSessionAndScanType(self, imageDir, project):
         """
         Find the subject and scan type from the image file name
         listed in the Image Eval XML string.
         """
-        _image_dir_split = imageDir.strip().split('/') 
-        _image_file = _image_dir_split[-1]
-        if project != "PHD_DTI_THP":
-            _image_file_pattern = re.compile('([^_]*)_([^_]*)_([^_]*)_[^-]*')
-        else:
-            _image_file_pattern = re.compile('([^_]*)_([^_]*_[^_]*)_([^_]*)_[^-]*')            
-        _image_file_group = _image_file_pattern.match(_image_file)             
-        if _image_file_group is not None and len(_image_file_group.groups()) == 3:
-            _subject = _image_file_group.group(1)
-            _session = _image_file_group.group(2)
-            _scanType = _image_file_group.group(3)
-            return _subject, _session, _scanType
-        else:
-            print("ERROR: Invalid number of groups. {0}".format(_image_file))
-            return "NOT_FOUND", "NOT_FOUND", "NOT_FOUND"
+        _subject_session_scanType = parseImageFile(imageDir, project)
+        if _subject_session_scanType == NOT_FOUND:
+            self._printInvalidImageFile(imageDir)
+        return _subject_session_scanType
+    
+    def _printInvalidImageFile(self, imageDir):
+        printLine("ERROR: Invalid number of groups. {0}".format(imageDir.strip().split('/')[-1]))
              
-    def _getSQLiteCommand(self, EvalDict):
-        """
-        Cycle through the parsed information gathered for each Image Evaluation
-        XML file. Create the SQLite command to add info to a new ImageEval
-        database row.        
-        """
-        _col_names = EvalDict.keys()
-        _col_names_str = ""
-        _row =  ""
-        for _col in _col_names:
-            _col_names_str += "{0}, ".format(_col)
-            _eval_info = EvalDict[_col]
-            _eval_info = _eval_info.replace("'", "''")
-            _row += "'{0}', ".format(_eval_info)
-        _col_names_str = _col_names_str[:-2] ## trim the excess comma and space from the end of the string
-        _row = _row[:-2]                     ## trim the excess comma and space from the end of the string
-        # create an SQLite command that adds data from each Image Eval file to the ImageEval database row by row 
-        _SQLite_command = "INSERT INTO ImageEval ({0}) VALUES ({1});".format(_col_names_str, _row)
-        return  _SQLite_command
- 
+    def printReports(self):
+        """
+        Write the CSV files (and the columnar copy, if requested) from the
+        ImageEval database, then close the database connection.
+        """
+        exporters = [self.printDBtoCSVfile, self.printAutoWorkupCSV, self.printImagesNotInFileSystem]
+        if self.columnar:
+            exporters.append(self.printDBtoColumnarFile)
+        for exporter in exporters:
+            with self.timer.measure(exporter.__name__):
+                exporter()
+        self.closeDataBase()
+        
     def printDBtoCSVfile(self):
         """
         Print all of the information in the ImageEval database to a csv file
         called "ImageEval_database.csv" saved in the current working directory.
+        The rows are streamed from the database "fetchSize" at a time.
         """
-        con = lite.connect(self.dbFileName)
-        dbCur = con.cursor()
-        SQLiteCommand = "SELECT * FROM ImageEval ORDER BY project, subject, session, seriesnumber, scantype;"
-        dbCur.execute(SQLiteCommand)
-        DBinfo = dbCur.fetchall()
-        col_name_list = [tuple[0] for tuple in dbCur.description]
-        dbCur.close()
-        Handle = csv.writer(open('ImageEval_database.csv', 'wb'),
-                            quoting=csv.QUOTE_ALL)
-        Handle.writerow(col_name_list)
-        for row in DBinfo:
-            Handle.writerow(row)                
+        SQLiteCommand = "SELECT {0} FROM ImageEval ORDER BY project, subject, session, seriesnumber, scantype;".format(
+            ", ".join(IMAGE_EVAL_COLUMNS))
+        with self._openOutput('ImageEval_database.csv') as csv_file:
+            Handle = csv.writer(csv_file, quoting=csv.QUOTE_ALL)
+            Handle.writerow(IMAGE_EVAL_COLUMNS)
+            for rows in self.getBatchesFromDB(SQLiteCommand, utf8 = True):
+                Handle.writerows(rows)
+                
+    def printDBtoColumnarFile(self):
+        """
+        Write the ImageEval database column by column to
+        "ImageEval_database.parquet" (with pyarrow) or "ImageEval_database.cols"
+        (see ColumnarExportWriter) for analysis jobs that would otherwise
+        parse "ImageEval_database.csv" again.
+        """
+        SQLiteCommand = "SELECT {0} FROM ImageEval ORDER BY project, subject, session, seriesnumber, scantype;".format(
+            ", ".join(IMAGE_EVAL_COLUMNS))
+        writer = ColumnarExportWriter('ImageEval_database', IMAGE_EVAL_COLUMNS)
+        for rows in self.getBatchesFromDB(SQLiteCommand):
+            writer.writeRows(rows)
+        writer.close()
+        print "Wrote {0}".format(writer.fileName)
          
     def printAutoWorkupCSV(self):
         """
-        
-        """                
-        Handle = csv.writer(open('proj_subj_session_imagefiles.csv', 'wb'),
-                            quoting=csv.QUOTE_ALL)
-        col_name_list = ["project", "subject", "session", "imagefiles"]
-        Handle.writerow(col_name_list)
-        tmp_session = None
-        line = None
+        Print one row per session to "proj_subj_session_imagefiles.csv" with
+        the image files that scored above 5 and are in the file system,
+        grouped by scan type (see getAutoWorkupRows).
+        """
+        with self._openOutput('proj_subj_session_imagefiles.csv') as csv_file:
+            Handle = csv.writer(csv_file, quoting=csv.QUOTE_ALL)
+            Handle.writerow(["project", "subject", "session", "imagefiles"])
+            Handle.writerows(self.getAutoWorkupRows())
+            
+    def getAutoWorkupRows(self):
+        """
+        Yields a (project, subject, session, imagefiles) row for each
+        session.  "imagefiles" is written like a dictionary of scan type ->
+        list of image files, with the scan types sorted and the image files
+        of each scan type in order of decreasing score, e.g.
+        "{'T1-30': ['/paulsen/MRx/.../10026_20305_T1-30_3.nii.gz'], 'T2-30': [...]}"
+        The query returns the rows already grouped, so each session is
+        built once from its own rows.
+        """
         SQLiteCommand = "SELECT project, subject, session, overallqaassessment, scantype, imagefile "
-        SQLiteCommand += "FROM ImageEval WHERE overallqaassessment > 5 AND substr(imagefile,0,5) != 'File'"
-        SQLiteCommand += "ORDER BY project, subject, session, scantype, overallqaassessment DESC;"      
-        imagefile_info = self.getInfoFromDB(SQLiteCommand)
-        _iterator = range(0,len(imagefile_info))
-        for i in _iterator:
-            row = imagefile_info[i]
-            project = str(row[0])
-            subject = str(row[1])
-            session = str(row[2])
-            scan_type = str(row[4])
-            imagefile = str(row[5])
-            if tmp_session != session:
-                eval_dict = dict()
-                eval_dict[scan_type] = [imagefile]
-                if line is not None:
-                    Handle.writerow(line) 
-            else:
-                if scan_type in eval_dict.keys():
-                    eval_dict[scan_type].append(imagefile)
-                else:
-                    eval_dict[scan_type] = [imagefile]
-            tmp_session = session
-            sorted_eval_dict = sort(eval_dict)
-            line = (project, subject, session, sorted_eval_dict)
-            ## make sure to print the last row
-            if i == _iterator[-1]:
-                Handle.writerow(line)
+        SQLiteCommand += "FROM ImageEval WHERE overallqaassessment > 5 AND file_exists = 1 "
+        SQLiteCommand += "ORDER BY project, subject, session, scantype, overallqaassessment DESC;"
+        rows = self.getInfoFromDB(SQLiteCommand, utf8 = True)
+        for ((project, subject, session), session_rows) in itertools.groupby(rows, operator.itemgetter(0, 1, 2)):
+            eval_dict = ["{0!r}: {1!r}".format(str(scan_type), [str(row[5]) for row in scan_rows])
+                         for (scan_type, scan_rows) in itertools.groupby(session_rows, operator.itemgetter(4))]
+            yield (str(project), str(subject), str(session), "{" + ", ".join(eval_dict) + "}")
          
     def printImagesNotInFileSystem(self): 
-        Handle = csv.writer(open('images_not_in_file_system.csv', 'wb'),
-                            quoting=csv.QUOTE_ALL)
-        Handle.writerow(["image files not in the file system"])
-        SQLiteCommand = "SELECT substr(imagefile,38) FROM ImageEval "
-        SQLiteCommand += "WHERE overallqaassessment > 5 AND substr(imagefile,0,5) = 'File'"
+        SQLiteCommand = "SELECT imagefile FROM ImageEval "
+        SQLiteCommand += "WHERE overallqaassessment > 5 AND file_exists = 0 "
         SQLiteCommand += "ORDER BY project, subject, session, scantype, overallqaassessment DESC;"
-        imagefile_info = self.getInfoFromDB(SQLiteCommand)
-        for line in imagefile_info:
-            Handle.writerow(line)
+        with self._openOutput('images_not_in_file_system.csv') as csv_file:
+            Handle = csv.writer(csv_file, quoting=csv.QUOTE_ALL)
+            Handle.writerow(["image files not in the file system"])
+            for rows in self.getBatchesFromDB(SQLiteCommand, utf8 = True):
+                Handle.writerows(rows)
         
-    def getInfoFromDB(self, SQLiteCommand):
-        con = lite.connect(self.dbFileName)
+    def getInfoFromDB(self, SQLiteCommand, utf8 = False):
+        """ Yields the rows of a query, see getBatchesFromDB. """
+        for rows in self.getBatchesFromDB(SQLiteCommand, utf8):
+            for row in rows:
+                yield row
+                
+    def getBatchesFromDB(self, SQLiteCommand, utf8 = False):
+        """
+        Yields the rows of a query in lists of "fetchSize" rows, so that
+        the exports never hold a whole table in memory.  With "utf8" the
+        text is returned as UTF-8 byte strings, which the csv module writes
+        as they are, instead of unicode.
+        """
+        con = self.getConnection()
+        text_factory = con.text_factory
+        if utf8:
+            con.text_factory = str
         dbCur = con.cursor()
-        dbCur.execute(SQLiteCommand)
-        DBinfo = dbCur.fetchall()
-        dbCur.close()
-        return DBinfo
+        try:
+            dbCur.execute(SQLiteCommand)
+            rows = dbCur.fetchmany(self.fetchSize)
+            while rows:
+                yield rows
+                rows = dbCur.fetchmany(self.fetchSize)
+        finally:
+            dbCur.close()
+            con.text_factory = text_factory
+            
+    def getConnection(self):
+        """
+        Returns the connection to ImageEvals.db shared by all the steps of a
+        run.  It is only ever used by one thread at a time: the write stage
+        of the pipeline while the database is filled, the main thread
+        otherwise.
+        """
+        if self._con is None:
+            self._con = lite.connect(self.dbFileName, check_same_thread = False)
+            ## the rows deleted by INSERT OR REPLACE only fire the ScoreHistogram triggers with this on
+            self._con.execute("PRAGMA recursive_triggers = ON;")
+        return self._con
+        
+    def closeDataBase(self):
+        if self._con is not None:
+            self._con.close()
+            self._con = None
+            
+    def _openOutput(self, fileName):
+        """ Opens an export file, gzip compressed with a ".gz" suffix if "gzipOutput" is set. """
+        if self.gzipOutput:
+            return gzip.open(fileName + '.gz', 'wb', 6)
+        return open(fileName, 'wb')
          
-class ParseToFields():
-    def __init__(self,xmlString):
-        self._project       = ""  # The project for this XML main label for this subject,
-                                  # in the form of "{sessionID}_{scanid}_IR
-        self._label         = ""
-        self._imageReviewID = ""
-        self._session       = ""
-        self._subject_ID    = ""
-        self._session_ID    = ""
-        self._session_LABEL = ""
-        self._series_number = ""
-        self._date          = ""
-        self._time          = ""
-        self._fieldDict     = dict({'susceptibilitymetal': 'NULL',
-                              'scantype': 'NULL',
-                              'flowartifact': 'NULL',
-                              'freeformnotes': ' ',
-                              'subject': 'NULL',
-                              'session': 'NULL',
-                              'seriesnumber': 'NULL',
-                              'cnr': 'NULL',
-                              'overallqaassessment': 'NULL',
-                              'truncationartifact': 'NULL',
-                              'ghostingmotion': 'NULL',
-                              'imagefile': 'NULL',
-                              'lesions': 'NULL',
-                              'misalignment': 'NULL',
-                              'snr': 'NULL',
-                              'date': 'NULL',
-                              'evaluator': 'NULL',
-                              'xnatImageReviewLabel': 'NULL',
-                              'fullbraincoverage': 'NULL',
-                              'normalvariants': 'NULL',
-                              'evaluationcompleted': 'NULL',
-                              'project': 'NULL',
-                              'swapwraparound': 'NULL',
-                              'inhomogeneity': 'NULL',
-                              'time': 'NULL'})
-        self._sql_col_names  = list()
-        self._string=xmlString
-        myelem=et.fromstring(self._string)
+class PhaseTimer():
+    """
+    Collect how long each phase of a run takes: the experiment listing,
+    every XNAT request, every parse, the file system checks, the database
+    inserts, every export and every boxplot figure.  One PhaseTimer is
+    shared by the objects of a run and may be used from several threads.
+    save() writes a JSON summary with the count, the total, the p50, p95,
+    p99 and maximum durations in seconds and the bytes of every phase,
+    plus any other "sections" such as the pipeline counters.  The count,
+    total and maximum are exact.  The percentiles of a phase with more than
+    "maxSamples" durations are those of a uniform random sample of them, so
+    the memory used does not grow with the length of the run.
+    """
+    
+    def __init__(self, maxSamples = 10000):
+        self.startTime = time.time()
+        self.sections = collections.OrderedDict()
+        self.maxSamples = maxSamples
+        self._samples = collections.defaultdict(list)
+        self._counts = collections.defaultdict(int)
+        self._totals = collections.defaultdict(float)
+        self._maxima = dict()
+        self._bytes = collections.defaultdict(int)
+        self._random = random.Random(0)
+        self._lock = threading.Lock()
+        
+    def record(self, phase, seconds, nbytes = 0):
+        with self._lock:
+            self._counts[phase] += 1
+            self._totals[phase] += seconds
+            self._maxima[phase] = max(self._maxima.get(phase, seconds), seconds)
+            self._bytes[phase] += nbytes
+            samples = self._samples[phase]
+            if len(samples) < self.maxSamples:
+                samples.append(seconds)
+            else:
+                ## reservoir sampling: every duration is kept with the same probability
+                index = self._random.randrange(self._counts[phase])
+                if index < self.maxSamples:
+                    samples[index] = seconds
+            
+    @contextlib.contextmanager
+    def measure(self, phase):
+        """ Time the body of a "with" block as one sample of "phase". """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(phase, time.time() - start)
+            
+    def summary(self):
+        with self._lock:
+            samples = dict((phase, list(values)) for (phase, values) in self._samples.items())
+        phases = collections.OrderedDict()
+        for phase in sorted(samples):
+            (p50, p95, p99) = self._percentiles(samples[phase], [0.5, 0.95, 0.99])
+            phases[phase] = collections.OrderedDict([('count', self._counts[phase]), ('total', self._totals[phase]),
+                                                     ('p50', p50), ('p95', p95), ('p99', p99),
+                                                     ('max', self._maxima[phase]), ('bytes', self._bytes[phase])])
+        summary = collections.OrderedDict([('seconds', time.time() - self.startTime), ('phases', phases)])
+        summary.update(self.sections)
+        return summary
+    
+    def _percentiles(self, values, fractions):
+        """ Linear interpolation between the closest ranks, as numpy.percentile does. """
+        values = sorted(values)
+        result = list()
+        for fraction in fractions:
+            position = fraction * (len(values) - 1)
+            lower = int(position)
+            upper = min(lower + 1, len(values) - 1)
+            result.append(values[lower] + (position - lower) * (values[upper] - values[lower]))
+        return result
+    
+    def save(self, fileName):
+        with open(fileName, 'w') as handle:
+            json.dump(self.summary(), handle, indent = 2)
+            
+    def printSummary(self):
+        print "{0:>28} {1:>7} {2:>9} {3:>9} {4:>9} {5:>9} {6:>10}".format(
+            'phase', 'count', 'total s', 'p50 ms', 'p95 ms', 'p99 ms', 'MB')
+        for (phase, stats) in self.summary()['phases'].items():
+            print "{0:>28} {1:>7} {2:>9.2f} {3:>9.1f} {4:>9.1f} {5:>9.1f} {6:>10.1f}".format(
+                phase, stats['count'], stats['total'], stats['p50'] * 1000, stats['p95'] * 1000,
+                stats['p99'] * 1000, stats['bytes'] / 1024.0 ** 2)
+                
+class ImageEvalWriter():
+    """
+    Write rows to the ImageEval table with one prepared, parameterized
+    INSERT.  Rows are buffered and written with executemany() in batches of
+    "batchSize" rows, and the transaction is committed every "commitSize"
+    rows.  The SyncState of each experiment, loaded or failed, is written in
+    the same transaction as its rows, so every commit is a checkpoint a
+    resumed sync can continue from.  When a batch cannot be written its
+    rows are written again one at a time, and the experiments whose rows
+    still fail are recorded as failed instead of loaded.  A bulk load (a
+    rebuild of the whole database) runs with journal_mode=WAL and
+    synchronous=OFF, and without the ScoreHistogram triggers: the table is
+    refilled with one GROUP BY when the writer is closed.
+    """
+    
+    def __init__(self, con, batchSize = 500, commitSize = 5000, bulkLoad = False, timer = None):
+        self.con = con
+        self.timer = timer or PhaseTimer()
+        self.batchSize = batchSize
+        self.commitSize = commitSize
+        self.bulkLoad = bulkLoad
+        self._insertCommand = "INSERT OR REPLACE INTO ImageEval ({0}) VALUES ({1});".format(
+            ", ".join(IMAGE_EVAL_COLUMNS), ", ".join(["?"] * len(IMAGE_EVAL_COLUMNS)))
+        ## the attempts of an experiment are counted across runs
+        self._syncStateCommand = ("INSERT OR REPLACE INTO SyncState (xnatImageReviewID, lastmodified, status, error, "
+                                  "attempts) VALUES (?1, ?2, ?3, ?4, 1 + COALESCE((SELECT attempts FROM SyncState "
+                                  "WHERE xnatImageReviewID = ?1), 0));")
+        self._rows = list()
+        self._syncStates = list()
+        self._writeErrors = dict()  ## xnatImageReviewID -> error of the rows that could not be written
+        self._uncommitted = 0
+        self.failures = 0
+        if bulkLoad:
+            con.execute("PRAGMA journal_mode=WAL;")
+            con.execute("PRAGMA synchronous=OFF;")
+            for name in SCORE_HISTOGRAM_TRIGGERS:
+                con.execute("DROP TRIGGER IF EXISTS {0};".format(name))
+            
+    def addRow(self, row):
+        """ Queue a row whose values are in the order of IMAGE_EVAL_COLUMNS. """
+        self._rows.append(row)
+        if len(self._rows) >= self.batchSize:
+            self.flush()
+            
+    def addSyncState(self, syncInfo):
+        """ Queue the (xnatImageReviewID, lastmodified) SyncState of a loaded experiment. """
+        self._syncStates.append(tuple(syncInfo) + ('done', None))
+        
+    def addFailure(self, syncInfo, error):
+        """ Queue the SyncState of an experiment that could not be loaded, with the reason. """
+        self._syncStates.append(tuple(syncInfo) + ('failed', error))
+        self.failures += 1
+        
+    def flush(self):
+        (rows, syncStates) = (self._rows, self._syncStates)
+        self._rows = list()
+        self._syncStates = list()
+        with self.timer.measure('insert_batch'):
+            try:
+                self.con.executemany(self._insertCommand, rows)
+            except lite.Error:
+                self._insertRowByRow(rows)
+            if self._writeErrors:
+                syncStates = [self._checkSyncState(syncState) for syncState in syncStates]
+            self.con.executemany(self._syncStateCommand, syncStates)
+        self._uncommitted += len(rows)
+        if self._uncommitted >= self.commitSize:
+            with self.timer.measure('commit'):
+                self.con.commit()
+            self._uncommitted = 0
+            
+    def _insertRowByRow(self, rows):
+        """ Insert the rows of a batch that failed one at a time, keeping the error of each experiment that fails. """
+        for row in rows:
+            try:
+                self.con.execute(self._insertCommand, row)
+            except lite.Error as error:
+                imageReviewID = row[IMAGE_EVAL_COLUMNS.index('xnatImageReviewID')]
+                printLine("ERROR: Could not write Image Eval {0}: {1}".format(imageReviewID, error))
+                self._writeErrors.setdefault(imageReviewID, "write: {0}".format(error))
+        ## an experiment is loaded with all its rows or not at all
+        self.con.executemany("DELETE FROM ImageEval WHERE xnatImageReviewID = ?;",
+                             [(imageReviewID,) for imageReviewID in self._writeErrors])
+        
+    def _checkSyncState(self, syncState):
+        """ The SyncState of an experiment, turned into a failure if its rows could not be written. """
+        (imageReviewID, lastModified, status, error) = syncState
+        if imageReviewID not in self._writeErrors:
+            return syncState
+        if status == 'done':
+            self.failures += 1
+        return (imageReviewID, lastModified, 'failed', self._writeErrors.pop(imageReviewID))
+        
+    def close(self):
+        self.flush()
+        self.con.commit()
+        if self.bulkLoad:
+            with self.timer.measure('fill_score_histogram'):
+                for statement in SCORE_HISTOGRAM_FILL_SQL + SCORE_HISTOGRAM_SQL[1:]:
+                    self.con.execute(statement)
+                self.con.commit()
+            ## fold the WAL file back into ImageEvals.db and return to the safe defaults
+            self.con.execute("PRAGMA synchronous=FULL;")
+            self.con.execute("PRAGMA journal_mode=DELETE;")
+        
+class ColumnarExportWriter():
+    """
+    Write rows column by column.  With pyarrow the rows are written to
+    "<fileName>.parquet".  Without it they are written to "<fileName>.cols":
+    a MAGIC line followed by one chunk per writeRows() call.  A chunk is a
+    JSON header line {"rows": n, "columns": [[name, kind, buffer sizes], ...]}
+    and then the buffers of each column: a uint8 NULL mask (empty if there
+    are no NULLs), then for "int64" columns the little-endian values, for
+    "utf8" columns the n + 1 uint32 offsets and the UTF-8 text.
+    readColumnarFile() reads it back.
+    """
+    MAGIC = 'ImageEval columns 1\n'
+    
+    def __init__(self, fileName, columns):
+        self.columns = columns
+        self._integer = [IMAGE_EVAL_TYPES.get(col, 'TEXT').startswith('INTEGER') for col in columns]
+        self._parquet = None
+        self._handle = None
+        self._pyarrow = pyarrow = importPyArrow()
+        if pyarrow is not None:
+            self.fileName = fileName + '.parquet'
+            self._schema = pyarrow.schema([pyarrow.field(col, pyarrow.int64() if integer else pyarrow.string())
+                                           for (col, integer) in zip(columns, self._integer)])
+            self._parquet = pyarrow.parquet.ParquetWriter(self.fileName, self._schema)
+        else:
+            self.fileName = fileName + '.cols'
+            self._handle = open(self.fileName, 'wb')
+            self._handle.write(self.MAGIC)
+            
+    def writeRows(self, rows):
+        if not rows:
+            return
+        column_values = zip(*rows)
+        if self._parquet is not None:
+            pyarrow = self._pyarrow
+            arrays = [pyarrow.array(values, type = field.type) for (values, field) in zip(column_values, self._schema)]
+            self._parquet.write_table(pyarrow.Table.from_arrays(arrays, schema = self._schema))
+            return
+        import numpy as np
+        header = {'rows': len(rows), 'columns': list()}
+        buffers = list()
+        for (col, integer, values) in zip(self.columns, self._integer, column_values):
+            nulls = np.array([value is None for value in values], dtype = np.uint8)
+            parts = [nulls.tostring() if nulls.any() else '']
+            if integer:
+                parts.append(np.array([0 if value is None else value for value in values], dtype = '<i8').tostring())
+            else:
+                text = [(u'' if value is None else unicode(value)).encode('utf-8') for value in values]
+                parts.append(np.cumsum([0] + [len(value) for value in text]).astype('<u4').tostring())
+                parts.append("".join(text))
+            header['columns'].append([col, 'int64' if integer else 'utf8', [len(part) for part in parts]])
+            buffers.extend(parts)
+        self._handle.write(json.dumps(header) + "\n")
+        for part in buffers:
+            self._handle.write(part)
+            
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+        else:
+            self._handle.close()
+            
+def readColumnarFile(fileName):
+    """
+    Yields one {column: array} dictionary per chunk of a ".cols" file
+    written by ColumnarExportWriter.  "int64" columns are NumPy masked
+    arrays, "utf8" columns are object arrays of unicode strings and None.
+    """
+    import numpy as np
+    with open(fileName, 'rb') as handle:
+        if handle.readline() != ColumnarExportWriter.MAGIC:
+            raise ValueError("{0} is not an ImageEval columnar file".format(fileName))
+        line = handle.readline()
+        while line:
+            header = json.loads(line)
+            chunk = collections.OrderedDict()
+            for (col, kind, sizes) in header['columns']:
+                parts = [handle.read(size) for size in sizes]
+                nulls = np.zeros(header['rows'], dtype = bool)
+                if parts[0]:
+                    nulls = np.frombuffer(parts[0], dtype = np.uint8).astype(bool)
+                if kind == 'int64':
+                    chunk[col] = np.ma.masked_array(np.frombuffer(parts[1], dtype = '<i8'), mask = nulls)
+                else:
+                    offsets = np.frombuffer(parts[1], dtype = '<u4')
+                    values = np.empty(header['rows'], dtype = object)
+                    for i in range(header['rows']):
+                        if not nulls[i]:
+                            values[i] = parts[2][offsets[i]:offsets[i + 1]].decode('utf-8')
+                    chunk[col] = values
+            yield chunk
+            line = handle.readline()
+            
+class ImageFileIndex():
+    """
+    Answer whether image files exist from one listing of each directory
+    instead of one stat of the (network) file system per file.  It may be
+    used by several threads at once, as the resolve stage does.  Only the
+    listings of the "maxDirs" most recently listed directories are kept,
+    the Image Evals of a session are listed together so they still find
+    theirs.  When "cacheFile" is given the listings are saved with the modification time
+    of each directory, and on the next run a directory that has not
+    changed since is not listed again.
+    """
+    _UNLISTED = object()
+    
+    def __init__(self, cacheFile = None, timer = None, maxDirs = 10000):
+        self.cacheFile = cacheFile
+        self.timer = timer or PhaseTimer()
+        self.maxDirs = maxDirs
+        self._lock = threading.Lock()
+        ## directory -> set of file names, None if it does not exist, in the order they were listed
+        self._dirs = collections.OrderedDict()
+        self._listings = dict()  ## directory -> [modification time, file names] saved between runs
+        if cacheFile is not None and os.path.exists(cacheFile):
+            with open(cacheFile) as handle:
+                self._listings = json.load(handle)
+                
+    def exists(self, path):
+        (dirname, name) = os.path.split(path)
+        names = self._dirs.get(dirname, self._UNLISTED)
+        if names is self._UNLISTED:
+            names = self._listDirectory(dirname)
+        return names is not None and name in names
+    
+    def save(self):
+        """ Save the directory listings to "cacheFile". """
+        if self.cacheFile is None:
+            return
+        tmp_path = self.cacheFile + '.tmp'
+        with open(tmp_path, 'w') as handle:
+            json.dump(self._listings, handle)
+        os.rename(tmp_path, self.cacheFile)
+        
+    def _listDirectory(self, dirname):
+        start = time.time()
+        try:
+            mtime = os.stat(dirname).st_mtime
+            saved = self._listings.get(dirname)
+            if saved is not None and saved[0] == mtime:
+                names = frozenset(saved[1])
+            else:
+                file_list = os.listdir(dirname)
+                names = frozenset(file_list)
+                if self.cacheFile is not None:
+                    with self._lock:
+                        self._listings[dirname] = [mtime, file_list]
+        except OSError:
+            names = None
+        self.timer.record('list_directory', time.time() - start)
+        with self._lock:
+            self._dirs[dirname] = names
+            while len(self._dirs) > self.maxDirs:
+                self._dirs.popitem(last = False)
+        return names
+        
+class PipelineStage():
+    """
+    One stage of the pipeline that fills the database.  "workers" threads
+    take items from a bounded queue, call "function" with each one and put
+    the items of the list it returns on the queue of the "next" stage.  A
+    full queue blocks the stages that feed it, so a slow stage holds back
+    the ones before it instead of letting items pile up in memory.  The
+    stage stops once each of its "producers" has called close(), and then
+    closes the next stage.  "finish" is called by each worker thread as it
+    stops.  The stage counts the items it takes and passes on, the errors
+    of "function", the time its workers are busy and the depth of its queue.
+    """
+    _STOP = object()
+    
+    def __init__(self, name, function, workers = 1, queueSize = 64, producers = 1, finish = None):
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+        self.finish = finish
+        self.next = None
+        self.queue = Queue.Queue(maxsize = queueSize)
+        self.itemsIn = 0
+        self.itemsOut = 0
+        self.errors = 0
+        self.busyTime = 0.0
+        self.maxDepth = 0
+        self._depthTotal = 0
+        self._producers = producers
+        self._running = 0
+        self._startTime = None
+        self._stopTime = None
+        self._lock = threading.Lock()
+        self._threads = list()
+        
+    def start(self):
+        self._startTime = time.time()
+        self._running = self.workers
+        for i in range(self.workers):
+            thread = threading.Thread(target = self._work, name = "{0}-{1}".format(self.name, i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+            
+    def put(self, item):
+        """ Queue an item, waiting while the queue is full. """
+        self.queue.put(item)
+        
+    def close(self):
+        """ Called by each producer after its last item. """
+        with self._lock:
+            self._producers -= 1
+            last = self._producers == 0
+        if last:
+            for i in range(self.workers):
+                self.queue.put(self._STOP)
+                
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+            
+    def report(self):
+        """ Returns the counters of the stage. """
+        elapsed = max((self._stopTime or time.time()) - self._startTime, 1e-6)
+        return {'stage': self.name, 'workers': self.workers, 'in': self.itemsIn, 'out': self.itemsOut,
+                'errors': self.errors, 'per_second': self.itemsIn / elapsed,
+                'busy': self.busyTime / (elapsed * self.workers),
+                'mean_queue': self._depthTotal / float(max(self.itemsIn, 1)), 'max_queue': self.maxDepth}
+    
+    def _work(self):
+        while True:
+            depth = self.queue.qsize()
+            item = self.queue.get()
+            if item is self._STOP:
+                break
+            start = time.time()
+            try:
+                results = self.function(item)
+            except Exception as error:
+                results = None
+                with self._lock:
+                    self.errors += 1
+                printLine("ERROR: {0} stage failed: {1!r}".format(self.name, error))
+            busy = time.time() - start
+            with self._lock:
+                self.itemsIn += 1
+                self.itemsOut += len(results or ())
+                self.busyTime += busy
+                self._depthTotal += depth
+                self.maxDepth = max(self.maxDepth, depth)
+            if results and self.next is not None:
+                for result in results:
+                    self.next.put(result)
+        try:
+            if self.finish is not None:
+                self.finish()
+        except Exception as error:
+            with self._lock:
+                self.errors += 1
+            printLine("ERROR: {0} stage failed to finish: {1!r}".format(self.name, error))
+        with self._lock:
+            self._running -= 1
+            last = self._running == 0
+        if last:
+            self._stopTime = time.time()
+            if self.next is not None:
+                self.next.close()
+                
+class XNATFetcher():
+    """
+    Download documents from the XNAT REST interface.  Every thread that
+    calls fetch() keeps its own keep-alive HTTP(S) connection open, so the
+    threads of the fetch stage download many Image Eval XML files at once
+    without opening a new connection for every request.  Failed requests
+    are retried with an exponential backoff.  The base URL may point at any
+    server, for example a local stub server that serves canned experiment
+    XML.
 
-        self._project=myelem.attrib['project']
-        self._label  =myelem.attrib['label']
-        self._imageReviewID = myelem.attrib['ID']
-        for child in myelem.getiterator():
-            if child.tag == '{http://nrg.wustl.edu/phd}field':
-                myatts=dict(child.items())
-                self._sql_col_names.append(self.makeSQLColName(myatts['name']))
-                if 'value' in myatts.keys(): 
-                    self._fieldDict[self.makeSQLColName(myatts['name'])] = myatts['value']
-                ## Assign an empty string if there is no value for "free form notes".
-                elif 'value' not in myatts.keys() and myatts['name'] == "Free Form Notes":
-                    self._fieldDict[self.makeSQLColName(myatts['name'])] = " "
-                    print "ERROR: No value for \"Free Form Notes\" field in ImageEval for {0}".format(self._imageReviewID)
-                pass
-            elif child.tag  == '{http://nrg.wustl.edu/xnat}date':
-                self._date = child.text
-                pass
-            elif child.tag  == '{http://nrg.wustl.edu/xnat}time':
-                self._time = child.text
-                pass
-            elif child.tag  == '{http://nrg.wustl.edu/phd}series_number':
-                self._series_number = child.text
-                pass
-            elif child.tag  == '{http://nrg.wustl.edu/xnat}imageSession_ID':
-                self._session_ID = child.text
-                pass
+    When an XMLCache is given, cached documents are revalidated with
+    If-None-Match/If-Modified-Since and are not downloaded again when the
+    server answers "304 Not Modified".  In offline mode every document is
+    read from the cache and the network is never used.
+    """
+    
+    def __init__(self, baseURL, username = None, pword = None, retries = 3, timeout = 60,
+                 backoff = 1.0, cache = None, offline = False, timer = None):
+        url = urlparse.urlsplit(baseURL)
+        self.scheme = url.scheme
+        self.host = url.netloc
+        self.pathPrefix = url.path.rstrip('/')
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.cache = cache
+        self.offline = offline
+        self.timer = timer or PhaseTimer()
+        self._headers = {'Connection': 'keep-alive'}
+        if username is not None:
+            token = base64.b64encode("{0}:{1}".format(username, pword))
+            self._headers['Authorization'] = "Basic {0}".format(token)
+        self._local = threading.local()
+        
+    def fetch(self, path):
+        """
+        Return the body of the document at "path" (relative to the base URL).
+        Connection errors, timeouts and server errors are retried; any other
+        HTTP error is raised straight away.
+        """
+        validators = None
+        if self.cache is not None:
+            validators = self.cache.lookup(path)
+        if self.offline:
+            body = None
+            if validators is not None:
+                body = self.cache.read(path)
+            if body is None:
+                error = IOError("{0} is not in the XNAT cache".format(path))
+                error.status = 404
+                raise error
+            return body
+        attempt = 0
+        while True:
+            try:
+                return self._request(path, validators)
+            except (IOError, httplib.HTTPException) as error:
+                attempt += 1
+                if attempt > self.retries or getattr(error, 'status', 500) < 500:
+                    raise
+                sleep(self.backoff * 2 ** (attempt - 1))
+                
+    def _request(self, path, validators = None):
+        headers = dict(self._headers)
+        if validators is not None:
+            (etag, lastModified) = validators
+            if etag:
+                headers['If-None-Match'] = etag
+            if lastModified:
+                headers['If-Modified-Since'] = lastModified
+        con = self._getConnection()
+        start = time.time()
+        try:
+            con.request('GET', self.pathPrefix + path, headers = headers)
+            response = con.getresponse()
+            body = response.read()
+        except (IOError, httplib.HTTPException):
+            ## the connection is in an unknown state, reconnect on the next request
+            self._closeConnection()
+            self.timer.record('xnat_request_failed', time.time() - start)
+            raise
+        self.timer.record('xnat_request', time.time() - start, len(body))
+        if response.status == 304 and validators is not None:
+            body = self.cache.read(path)
+            if body is None:
+                ## evicted since the lookup, download it again unconditionally
+                return self._request(path)
+            return body
+        if response.status != 200:
+            error = IOError("HTTP {0} {1} for {2}".format(response.status, response.reason, path))
+            error.status = response.status
+            raise error
+        if self.cache is not None:
+            self.cache.store(path, body, response.getheader('etag'), response.getheader('last-modified'))
+        return body
+        
+    def _getConnection(self):
+        """ Returns the keep-alive connection owned by the calling thread. """
+        con = getattr(self._local, 'connection', None)
+        if con is None:
+            if self.scheme == 'https':
+                con = httplib.HTTPSConnection(self.host, timeout = self.timeout)
+            else:
+                con = httplib.HTTPConnection(self.host, timeout = self.timeout)
+            self._local.connection = con
+        return con
+    
+    def _closeConnection(self):
+        con = getattr(self._local, 'connection', None)
+        if con is not None:
+            con.close()
+            self._local.connection = None
+
+class XMLCache():
+    """
+    On-disk cache of the documents downloaded from XNAT.  Each document is
+    stored gzip-compressed in a file named after the SHA-1 of its content,
+    and the "index.db" SQLite file maps every URI to its content digest and
+    to the ETag/Last-Modified headers needed to revalidate it.  When the
+    compressed files grow beyond "maxBytes" the least recently used URIs are
+    evicted.  The total size is kept up to date as documents are stored, and
+    the index changes are committed "commitSize" documents at a time and by
+    flush().
+    """
+    
+    def __init__(self, cacheDir, maxBytes = 1024 * 1024 ** 2, commitSize = 100):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.commitSize = commitSize
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+        self._lock = threading.Lock()
+        self._accessed = dict()  ## uri -> access time not written to the index yet
+        self._changes = 0
+        self._con = lite.connect(os.path.join(cacheDir, 'index.db'), check_same_thread = False)
+        self._con.execute("CREATE TABLE IF NOT EXISTS CacheIndex(uri TEXT PRIMARY KEY, digest TEXT, "
+                          "etag TEXT, lastmodified TEXT, size INTEGER, accessed REAL);")
+        self._con.execute("CREATE INDEX IF NOT EXISTS CacheIndex_digest ON CacheIndex (digest);")
+        self._con.execute("CREATE INDEX IF NOT EXISTS CacheIndex_accessed ON CacheIndex (accessed);")
+        ## the size of the blobs referenced by the index, a blob shared by several URIs counts once
+        self._total = self._con.execute(
+            "SELECT TOTAL(size) FROM (SELECT DISTINCT digest, size FROM CacheIndex);").fetchone()[0]
+        if self._total > self.maxBytes:
+            self._evict()
+        self._con.commit()
+        
+    def lookup(self, uri):
+        """ Returns the (ETag, Last-Modified) pair of a cached URI, or None. """
+        with self._lock:
+            row = self._con.execute("SELECT etag, lastmodified FROM CacheIndex WHERE uri = ?;",
+                                    (uri,)).fetchone()
+        return row
+    
+    def read(self, uri):
+        """ Returns the cached document for a URI, or None if it is not cached. """
+        with self._lock:
+            row = self._con.execute("SELECT digest FROM CacheIndex WHERE uri = ?;", (uri,)).fetchone()
+            if row is None:
+                return None
+            self._accessed[uri] = time.time()
+            self._changed()
+        try:
+            cache_file = gzip.open(self._getBlobPath(row[0]), 'rb')
+            try:
+                return cache_file.read()
+            finally:
+                cache_file.close()
+        except IOError:
+            return None
+        
+    def store(self, uri, body, etag = None, lastModified = None):
+        digest = hashlib.sha1(body).hexdigest()
+        blob_path = self._getBlobPath(digest)
+        if not os.path.exists(blob_path):
+            ## write to a temporary file first so a partly written blob is never read
+            (handle, tmp_path) = tempfile.mkstemp(dir = self.cacheDir, suffix = '.tmp')
+            tmp_file = os.fdopen(handle, 'wb')
+            gzip_file = gzip.GzipFile(fileobj = tmp_file, mode = 'wb')
+            gzip_file.write(body)
+            gzip_file.close()
+            tmp_file.close()
+            os.rename(tmp_path, blob_path)
+        size = os.path.getsize(blob_path)
+        with self._lock:
+            old = self._con.execute("SELECT digest, size FROM CacheIndex WHERE uri = ?;", (uri,)).fetchone()
+            if not self._isReferenced(digest):
+                self._total += size
+            self._con.execute("INSERT OR REPLACE INTO CacheIndex VALUES (?, ?, ?, ?, ?, ?);",
+                              (uri, digest, etag, lastModified, size, time.time()))
+            self._accessed.pop(uri, None)
+            if old is not None and old[0] != digest:
+                self._release(*old)
+            if self._total > self.maxBytes:
+                self._evict()
+            self._changed()
+            
+    def flush(self):
+        """ Write the pending access times and commit the index. """
+        with self._lock:
+            self._writeAccessTimes()
+            self._con.commit()
+            self._changes = 0
+            
+    def _changed(self):
+        self._changes += 1
+        if self._changes >= self.commitSize:
+            self._writeAccessTimes()
+            self._con.commit()
+            self._changes = 0
+            
+    def _writeAccessTimes(self):
+        if self._accessed:
+            self._con.executemany("UPDATE CacheIndex SET accessed = ? WHERE uri = ?;",
+                                  [(accessed, uri) for (uri, accessed) in self._accessed.items()])
+            self._accessed.clear()
+            
+    def _isReferenced(self, digest):
+        return self._con.execute("SELECT 1 FROM CacheIndex WHERE digest = ?;", (digest,)).fetchone() is not None
+    
+    def _release(self, digest, size):
+        """ Remove the blob of "digest" once no URI refers to it. """
+        ## the blob may still be shared with another URI that has the same content
+        if self._isReferenced(digest):
+            return
+        self._total -= size
+        try:
+            os.remove(self._getBlobPath(digest))
+        except OSError:
+            pass
+        
+    def _evict(self):
+        self._writeAccessTimes()
+        while self._total > self.maxBytes:
+            lru_rows = self._con.execute("SELECT uri, digest, size FROM CacheIndex ORDER BY accessed "
+                                         "LIMIT 100;").fetchall()
+            if not lru_rows:
+                break
+            for (uri, digest, size) in lru_rows:
+                if self._total <= self.maxBytes:
+                    break
+                self._con.execute("DELETE FROM CacheIndex WHERE uri = ?;", (uri,))
+                self._release(digest, size)
             
-    def makeSQLColName(self, val):
-        val = val.replace(' ','').replace('/','').lower()
-        return val
+    def _getBlobPath(self, digest):
+        return os.path.join(self.cacheDir, digest + '.xml.gz')
 
-class MakeBoxplots():
+class ParseToRecord():
+    """
+    Streaming parser for Image Eval XML files.  The XML is read with
+    "iterparse" straight from a file object (an HTTP response, a cache file
+    or an in-memory buffer) and every element is cleared as soon as it has
+    been read, so the document tree is never held in memory.  The C
+    accelerated ElementTree is used when it is available.  The parsed
+    fields are returned as an ImageEvalRecord whose values are in the order
+    of IMAGE_EVAL_COLUMNS.  Fields that are not in the XML file are 'NULL',
+    except the free form notes (" ") and the date, time and series number
+    (empty).
+    """
+    _PHD = '{http://nrg.wustl.edu/phd}'
+    _XNAT = '{http://nrg.wustl.edu/xnat}'
     
     def __init__(self):
+        self._columnIndex = dict((col, index) for (index, col) in enumerate(IMAGE_EVAL_COLUMNS))
+        self._defaults = ['NULL'] * len(IMAGE_EVAL_COLUMNS)
+        for col in ('date', 'time', 'seriesnumber'):
+            self._defaults[self._columnIndex[col]] = ""
+        self._defaults[self._columnIndex['freeformnotes']] = " "
+        self._defaults[self._columnIndex['file_exists']] = 0
+        ## XML element tags with a single text value and the column each one fills
+        self._textTags = {self._XNAT + 'date': self._columnIndex['date'],
+                          self._XNAT + 'time': self._columnIndex['time'],
+                          self._PHD + 'series_number': self._columnIndex['seriesnumber']}
+        ## "phd:field" names are converted to column indexes once and then looked up
+        self._fieldIndex = dict()
+        
+    def parse(self, source):
+        values = list(self._defaults)
+        field_tag = self._PHD + 'field'
+        root = None
+        for (event, elem) in cet.iterparse(source, events = ('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                    values[self._columnIndex['project']] = elem.get('project')
+                    values[self._columnIndex['xnatImageReviewLabel']] = elem.get('label')
+                    values[self._columnIndex['xnatImageReviewID']] = elem.get('ID')
+                continue
+            if elem.tag == field_tag:
+                self._readField(elem, values)
+            elif elem.tag in self._textTags:
+                values[self._textTags[elem.tag]] = elem.text
+            elem.clear()
+        return ImageEvalRecord._make(values)
+    
+    def makeRecord(self, columnValues):
+        """
+        Returns an ImageEvalRecord from a dictionary of column values, such
+        as the columns of the experiment listing.  Columns that are missing,
+        None or empty are given the same defaults as fields missing from an
+        XML file: the listing has an empty value where the XML file has a
+        field without a value.
+        """
+        values = list(self._defaults)
+        for (col, value) in columnValues.items():
+            if value not in (None, ""):
+                values[self._columnIndex[col]] = value
+        return ImageEvalRecord._make(values)
+    
+    def _readField(self, elem, values):
+        name = elem.get('name')
+        index = self._fieldIndex.get(name)
+        if index is None:
+            index = self._columnIndex.get(name.replace(' ','').replace('/','').lower(), -1)
+            self._fieldIndex[name] = index
+        value = elem.get('value')
+        if index < 0:
+            return ## not a column of the ImageEval table
+        if value is not None:
+            values[index] = value
+        ## Assign an empty string if there is no value for "free form notes".
+        elif name == "Free Form Notes":
+            values[index] = " "
+            printLine("ERROR: No value for \"Free Form Notes\" field in ImageEval for {0}".format(
+                values[self._columnIndex['xnatImageReviewID']]))
+
+class ScoreSummary():
+    """
+    The overall QA assessment scores of the ImageEval table, read from the
+    ScoreHistogram table that the ImageEval triggers keep up to date.  It
+    has one row per site, scan type and score instead of one per Image
+    Eval, so reading it takes the same time however large ImageEval grows.
+    The score count, the count of scores greater than 5 and the boxplot
+    statistics of every (site, scan type) group and of every scan type over
+    all sites are computed from the histograms.  Missing scores are skipped.
+    """
+    
+    def __init__(self, dbFileName):
+        con = lite.connect(dbFileName)
+        rows = con.execute("SELECT project, scantype, score, count FROM ScoreHistogram WHERE count > 0 "
+                           "ORDER BY project, scantype, score;").fetchall()
+        con.close()
+        self.sites = sorted(set(row[0] for row in rows))
+        self.scanTypes = sorted(set(row[1] for row in rows))
+        self._siteGroups = dict()
+        all_site_counts = collections.defaultdict(collections.Counter)
+        for ((site, scan_type), group) in itertools.groupby(rows, operator.itemgetter(0, 1)):
+            histogram = [(score, count) for (project, scantype, score, count) in group]
+            self._siteGroups[(site, scan_type)] = self._summarize(histogram)
+            all_site_counts[scan_type].update(dict(histogram))
+        self._allSiteGroups = dict((scan_type, self._summarize(sorted(counts.items())))
+                                   for (scan_type, counts) in all_site_counts.items())
+        
+    def getGroup(self, site, scanType):
+        """
+        Returns (score count, count of scores greater than 5, boxplot
+        statistics) of a scan type at a site, or over all sites when "site"
+        is None.  Returns None when there are no scores for the group.
+        """
+        if site is None:
+            return self._allSiteGroups.get(scanType)
+        return self._siteGroups.get((site, scanType))
+    
+    def _summarize(self, histogram):
+        (scores, counts) = zip(*histogram)
+        greater_than_5 = sum([count for (score, count) in histogram if score > 5])
+        return sum(counts), greater_than_5, histogramBoxplotStats(scores, counts)
+
+def histogramBoxplotStats(values, counts, whis = 1.5):
+    """
+    Returns the statistics of the box-and-whisker plot of a sample given by
+    its sorted distinct "values" and their "counts", computed the way
+    matplotlib.cbook.boxplot_stats computes them from the whole sample, in
+    the form Axes.bxp() draws.
+    """
+    import numpy as np
+    values = np.asarray(values, dtype = float)
+    counts = np.asarray(counts, dtype = int)
+    total = counts.sum()
+    if total == 0:
+        return {'fliers': np.array([]), 'mean': np.nan, 'med': np.nan, 'q1': np.nan, 'q3': np.nan,
+                'cilo': np.nan, 'cihi': np.nan, 'whislo': np.nan, 'whishi': np.nan}
+    rank_ends = np.cumsum(counts)
+    def percentile(fraction):
+        ## linear interpolation between the closest ranks, as numpy.percentile does
+        position = fraction * (total - 1)
+        lower = int(np.floor(position))
+        (low, high) = values[np.searchsorted(rank_ends, [lower, min(lower + 1, total - 1)], side = 'right')]
+        return low + (position - lower) * (high - low)
+    (q1, med, q3) = [percentile(fraction) for fraction in (0.25, 0.5, 0.75)]
+    stats = {'mean': (values * counts).sum() / total, 'med': med, 'q1': q1, 'q3': q3, 'iqr': q3 - q1}
+    stats['cilo'] = med - 1.57 * stats['iqr'] / np.sqrt(total)
+    stats['cihi'] = med + 1.57 * stats['iqr'] / np.sqrt(total)
+    high = values[values <= q3 + whis * stats['iqr']]
+    stats['whishi'] = q3 if len(high) == 0 or high.max() < q3 else high.max()
+    low = values[values >= q1 - whis * stats['iqr']]
+    stats['whislo'] = q1 if len(low) == 0 or low.min() > q1 else low.min()
+    outside = (values < stats['whislo']) | (values > stats['whishi'])
+    stats['fliers'] = np.repeat(values[outside], counts[outside])
+    return stats
+
+def parseImageEvalXML(xmlString):
+    """
+    Parse one Image Eval XML document into an ImageEvalRecord.  This runs
+    in the parse processes of ParseXMLFilesAndFillDB.fillDBFromXMLs.  A
+    malformed document raises a ValueError, which unlike the ParseError of
+    cElementTree can be sent back from a parse process.
+    """
+    try:
+        return ParseToRecord().parse(StringIO.StringIO(xmlString))
+    except SyntaxError as error:
+        raise ValueError(str(error))
+
+def initRenderProcess():
+    """
+    Drop the fonts opened by the parent process.  After the fork they share
+    their file offsets with the parent, so reading them from several
+    processes at once corrupts the glyphs.
+    """
+    ## matplotlib 2.0 and later keep the open fonts in the private lru_cache
+    ## font_manager._get_font, which every matplotlib release for Python 2 (up
+    ## to 2.2) leaves filled in a forked process.  Releases before 2.0 have no
+    ## cache, so there is nothing to clear.
+    import matplotlib.font_manager
+    get_font = getattr(matplotlib.font_manager, '_get_font', None)
+    if hasattr(get_font, 'cache_clear'):
+        get_font.cache_clear()
+
+def renderBoxPlotPage(page):
+    """
+    Render one boxplot page to its own PDF file.  This runs in the worker
+    processes of MakeBoxplots.makePerSiteBoxPlot.
+    """
+    (fileName, all_stats, x_labels, scanTypeList, plotTitle) = page
+    start = time.time()
+    figure = MakeBoxplots().makeBoxPlotFigure(all_stats, x_labels, scanTypeList, plotTitle, 'large')
+    figure.savefig(fileName)
+    figure.clf()
+    return fileName, time.time() - start
+
+class MakeBoxplots():
+    
+    def __init__(self, processes = None, perSiteDir = None, timer = None):
         self.dbFileName = 'ImageEvals.db'
+        self.scoreTable = None
+        self.processes = processes or multiprocessing.cpu_count()
+        self.perSiteDir = perSiteDir
+        self.timer = timer or PhaseTimer()
+        importPlotting()
         
     def main(self):
-        self.makeAllSiteBoxPlot()
-        self.makePerSiteBoxPlot()
-
-    def getEvalScores(self, SQLite_query):
-        """
-        MakeEvalList changes the evals from unicode and tuple form i.e. [(u'7',), (u'6',), (u'1',)]  
-        to a list of integers necessary for calculations and making a box plot i.e. [7, 6, 1]
-        """
-        query_results = self._querySQLiteDB(SQLite_query)
-        eval_list = list()
-        for row in query_results:
-            new_eval = float(row[0])
-            eval_list.append(new_eval)
-        return eval_list      
-        
-    def _findEvalsGreaterThan5(self, evalScores):
-        count = 0
-        for val in evalScores:
-            if val > 5:
-                count += 1
-        return count
-    
-    def _querySQLiteDB(self, SQLite_query):
-        con = lite.connect(self.dbFileName)
-        dbCur = con.cursor()
-        dbCur.execute(SQLite_query)
-        query_results = dbCur.fetchall()
-        dbCur.close()
-        return query_results
-    
-    def getListFromDB(self, SQLite_query):
-        query_results = self._querySQLiteDB(SQLite_query)
-        List = list()
-        # the scan type from the database is stored in a tuple EX: (u'PD-15', )
-        for row in query_results:
-            list_item = row[0]
-            List.append(list_item)
-        return List
+        with self.timer.measure('ScoreSummary'):
+            self.scoreTable = ScoreSummary(self.dbFileName)
+        with self.timer.measure('makeAllSiteBoxPlot'):
+            self.makeAllSiteBoxPlot()
+        with self.timer.measure('makePerSiteBoxPlot'):
+            self.makePerSiteBoxPlot()
 
     def getEvalScoresAndXticks(self, site = None):
+        if self.scoreTable is None:
+            self.scoreTable = ScoreSummary(self.dbFileName)
         scanTypeList = [u'T1-30', u'T2-30', u'T1-15', u'T2-15', u'PD-15']
-        all_evals = list()
+        all_stats = list()
         x_labels = list()        
-        query_1 = self.getQuery1(site)
-        DB_scan_types = self.getListFromDB(query_1)    
         
         for scan_type in scanTypeList:
-            if scan_type in DB_scan_types:
-                query_2 = self.getQuery2(site, scan_type)
-                eval_scores = self.getEvalScores(query_2)   
-                all_evals.append(eval_scores)
-                count = self._findEvalsGreaterThan5(eval_scores)
-                x_labels.append(scan_type + "\n (" + str(count) + "/" + str(len(eval_scores)) + ")")
+            group = self.scoreTable.getGroup(site, scan_type)
+            if group is not None:
+                (total, count, stats) = group
+                all_stats.append(stats)
+                x_labels.append(scan_type + "\n (" + str(count) + "/" + str(total) + ")")
             else:
-                all_evals.append(list())
+                all_stats.append(histogramBoxplotStats([], []))
                 x_labels.append(scan_type + "\n (0)")
-        return all_evals, x_labels, scanTypeList
+        return all_stats, x_labels, scanTypeList
+    
+    def _boxplotProperties(self):
+        """
+        The line and marker properties of the boxes, whiskers, caps, medians
+        and fliers from the "boxplot.*" rcParams, which Axes.boxplot() passes
+        on to Axes.bxp() and Axes.bxp() does not read by itself.
+        """
+        properties = dict()
+        for (key, value) in rcParams.items():
+            parts = key.split('.')
+            if len(parts) == 3 and parts[0] == 'boxplot' and parts[1].endswith('props'):
+                properties.setdefault(parts[1], dict())[parts[2]] = value
+        return properties
+    
+    def makeBoxPlotFigure(self, all_stats, x_labels, scanTypeList, plotTitle, titleSize):
+        """
+        Returns a Figure, drawn with the Agg backend, with a box-and-whisker
+        plot of the evaluation scores grouped by the image scan type, drawn
+        from the statistics of each group (see histogramBoxplotStats).
+        """
+        figure = Figure()
+        FigureCanvasAgg(figure)
+        axes = figure.add_subplot(111)
+        axes.bxp(all_stats, **self._boxplotProperties())
+        axes.set_ylim(-0.1, 10.1)
+        axes.set_xticks(range(1, len(scanTypeList)+1))
+        axes.set_xticklabels(x_labels, fontsize = 'medium')
+        axes.tick_params(axis = 'y', labelsize = 'large')
+        axes.set_xlabel("\n \n Image Scan Type (Ratio of Scores Greater Than 5 to Total Scores)", fontsize = 'large')
+        axes.set_ylabel("Evalution Scores \n", fontsize = 'large')
+        axes.set_title(plotTitle, fontsize = titleSize)
+        figure.subplots_adjust(bottom = 0.2, top = 0.86, right = .88, left = 0.15)
+        return figure
     
     def makePerSiteBoxPlot(self):
         """
         This function makes a box-and-whisker plot showing the evaluation
         scores grouped by the image scan type.  
+        
+        Each site is rendered to its own PDF page by a pool of worker
+        processes, and the pages are joined in site order with PyPDF2.  When
+        "perSiteDir" is set, the page of every site is also kept there and is
+        only rendered again when the data of the site changed.  Without
+        PyPDF2 the joined file is rendered page by page in this process, and
+        the per site files are saved from the same figures.
+        """
+        if self.scoreTable is None:
+            self.scoreTable = ScoreSummary(self.dbFileName)
+        pages = list()
+        for site in self.scoreTable.sites:
+            (all_stats, x_labels, scanTypeList) = self.getEvalScoresAndXticks(site)
+            plotTitle = 'Evaluation Scores for Site {0} Grouped by Image Scan Type \n \n'.format(site)
+            pages.append((site, all_stats, x_labels, scanTypeList, plotTitle))
+        if PdfFileMerger is None:
+            if self.processes > 1:
+                print "WARNING: PyPDF2 is not installed, the per site boxplots are rendered in one process instead of {0}".format(
+                    self.processes)
+            (page_files, outdated) = ([None] * len(pages), set())
+            if self.perSiteDir is not None:
+                (page_dir, page_files, jobs, digests) = self._planSitePages(pages)
+                outdated = set(job[0] for job in jobs)
+            pp = pdfpages('ImageEvalBoxplots_perScanType_perSite.pdf')
+            for ((site, all_stats, x_labels, scanTypeList, plotTitle), page_file) in zip(pages, page_files):
+                with self.timer.measure('boxplot_site_figure'):
+                    figure = self.makeBoxPlotFigure(all_stats, x_labels, scanTypeList, plotTitle, 'large')
+                    pp.savefig(figure)
+                    if page_file in outdated:
+                        figure.savefig(page_file)
+                    figure.clf()
+            pp.close()
+            if self.perSiteDir is not None:
+                self._saveDigests(page_dir, digests, len(outdated))
+            return
+        (page_dir, page_files) = self._renderSitePages(pages)
+        with self.timer.measure('merge_site_pages'):
+            merger = PdfFileMerger()
+            for page_file in page_files:
+                merger.append(page_file)
+            merger.write('ImageEvalBoxplots_perScanType_perSite.pdf')
+            merger.close()
+        if self.perSiteDir is None:
+            shutil.rmtree(page_dir, ignore_errors = True)
+            
+    def _renderSitePages(self, pages):
+        """
+        Render the page of every site to its own PDF file with the process
+        pool.  Returns the directory of the files and the files in site
+        order.
+        """
+        (page_dir, page_files, jobs, digests) = self._planSitePages(pages)
+        if jobs:
+            pool = multiprocessing.Pool(min(self.processes, len(jobs)), initializer = initRenderProcess)
+            try:
+                for (page_file, seconds) in pool.map(renderBoxPlotPage, jobs):
+                    self.timer.record('boxplot_site_figure', seconds)
+            finally:
+                pool.close()
+                pool.join()
+        if self.perSiteDir is not None:
+            self._saveDigests(page_dir, digests, len(jobs))
+        return page_dir, page_files
+    
+    def _planSitePages(self, pages):
+        """
+        Returns the directory of the page files of the sites, the files in
+        site order, the renderBoxPlotPage jobs of the pages to render and the
+        digest of the data of every site.  In per-site mode a page is
+        skipped when its file exists and the digest of its data saved in
+        "digests.json" is unchanged.
         """
-        pp = pdfpages('ImageEvalBoxplots_perScanType_perSite.pdf')
-        site_list = self.getListFromDB("SELECT DISTINCT project FROM ImageEval;")
-        for site in site_list:
-            (all_evals, x_labels, scanTypeList) = self.getEvalScoresAndXticks(site)
-            boxplot(all_evals)
-            ylim(-0.1, 10.1)
-            xticks( arange(1, len(scanTypeList)+1), x_labels, fontsize = 'medium')
-            yticks(fontsize = 'large')
-            xlabel("\n \n Image Scan Type (Ratio of Scores Greater Than 5 to Total Scores)", fontsize = 'large')
-            ylabel("Evalution Scores \n", fontsize = 'large')
-            title('Evaluation Scores for Site {0} Grouped by Image Scan Type \n \n'.format(site), fontsize = 'large')
-            subplots_adjust(bottom = 0.2, top = 0.86, right = .88, left = 0.15)
-            pp.savefig()
-            hold(False)
-        pp.close()
+        import numpy as np
+        if self.perSiteDir is None:
+            page_dir = tempfile.mkdtemp()
+        else:
+            page_dir = self.perSiteDir
+            if not os.path.isdir(page_dir):
+                os.makedirs(page_dir)
+        digest_file = os.path.join(page_dir, 'digests.json')
+        old_digests = dict()
+        if self.perSiteDir is not None and os.path.exists(digest_file):
+            with open(digest_file) as handle:
+                old_digests = json.load(handle)
+        digests = dict()
+        page_files = list()
+        jobs = list()
+        for (site, all_stats, x_labels, scanTypeList, plotTitle) in pages:
+            page_file = os.path.join(page_dir, 'ImageEvalBoxplot_perScanType_{0}.pdf'.format(site))
+            page_files.append(page_file)
+            page_data = repr((plotTitle, x_labels, [sorted((key, np.asarray(value).tolist()) for (key, value) in stats.items())
+                                                    for stats in all_stats]))
+            digests[site] = hashlib.sha1(page_data).hexdigest()
+            if old_digests.get(site) != digests[site] or not os.path.exists(page_file):
+                jobs.append((page_file, all_stats, x_labels, scanTypeList, plotTitle))
+        return page_dir, page_files, jobs, digests
+    
+    def _saveDigests(self, page_dir, digests, rendered):
+        with open(os.path.join(page_dir, 'digests.json'), 'w') as handle:
+            json.dump(digests, handle)
+        print "Rendered {0} of {1} per site boxplot pages".format(rendered, len(digests))
         
     def makeAllSiteBoxPlot(self):
         """
         This function makes a box-and-whisker plot showing the evaluation
         scores grouped by the image scan type.          
         """
-        (all_evals, x_labels, scanTypeList) = self.getEvalScoresAndXticks()
-        boxplot(all_evals)
-        ylim(-0.1, 10.1)
-        xticks( arange(1, len(scanTypeList)+1), x_labels, fontsize = 'medium')
-        yticks(fontsize = 'large')
-        xlabel("\n \n Image Scan Type (Ratio of Scores Greater Than 5 to Total Scores)", fontsize = 'large')
-        ylabel("Evalution Scores \n", fontsize = 'large')
-        title('Evaluation Scores Grouped by Image Scan Type \n \n', fontsize = 'x-large')
-        subplots_adjust(bottom = 0.2, top = 0.86, right = .88, left = 0.15)
-        savefig("ImageEvalBoxplot_perScanType.pdf")
-        hold(False)        
-    
-    def getQuery1(self, site):
-        if site is None:
-            query1 = "SELECT DISTINCT scantype FROM ImageEval;"
-        else:
-            query1 = "SELECT DISTINCT scantype FROM ImageEval WHERE project = '{0}';".format(site)
-        return query1
+        (all_stats, x_labels, scanTypeList) = self.getEvalScoresAndXticks()
+        with self.timer.measure('boxplot_all_sites_figure'):
+            figure = self.makeBoxPlotFigure(all_stats, x_labels, scanTypeList,
+                                            'Evaluation Scores Grouped by Image Scan Type \n \n', 'x-large')
+            figure.savefig("ImageEvalBoxplot_perScanType.pdf")
+            figure.clf()
     
-    def getQuery2(self, site, scan_type):
-        if site is None:
-            query2 = "SELECT overallqaassessment FROM ImageEval WHERE scantype = '{0}';".format(scan_type)
-        else:
-            query2 = "SELECT overallqaassessment FROM ImageEval WHERE project = '{0}' AND scantype = '{1}';".format(site, scan_type)
-        return query2
+## the subcommands, "all" is run when none is given
+COMMANDS = ('sync', 'export', 'plot', 'all')
+
+def requireDataBase():
+    if not os.path.exists("ImageEvals.db"):
+        print("ERROR: No ImageEvals.db in current directory")
+        sys.exit(-1)
+        
+def syncImageEvals(inputArguments, timer):
+    """ Build the database from XNAT, or update it, and return its ParseXMLFilesAndFillDB. """
+    Object = ParseXMLFilesAndFillDB(xnatURL = inputArguments.xnatURL, workers = inputArguments.workers,
+                                    retries = inputArguments.retries, timeout = inputArguments.timeout,
+                                    incremental = inputArguments.incremental,
+                                    cacheDir = None if inputArguments.noCache else inputArguments.cacheDir,
+                                    cacheSize = inputArguments.cacheSize * 1024 ** 2,
+                                    offline = inputArguments.offline,
+                                    batchSize = inputArguments.batchSize,
+                                    commitSize = inputArguments.commitSize,
+                                    bulk = not inputArguments.noBulk,
+                                    pageSize = inputArguments.pageSize,
+                                    dirCacheFile = inputArguments.dirCacheFile,
+                                    fetchSize = getattr(inputArguments, 'fetchSize', 1000),
+                                    gzipOutput = getattr(inputArguments, 'gzipOutput', False),
+                                    columnar = getattr(inputArguments, 'columnar', False),
+                                    parseProcesses = inputArguments.parseProcesses,
+                                    queueSize = inputArguments.queueSize,
+                                    timer = timer, imageRoot = inputArguments.imageRoot,
+                                    resume = inputArguments.resume, retryPasses = inputArguments.retryPasses,
+                                    maxInFlight = inputArguments.maxInFlight)
+    Object.updateDataBase()
+    return Object
+
+def exportImageEvals(inputArguments, timer, Object = None):
+    """ Write the CSV files (and the columnar file) of the database of "Object" or of ImageEvals.db. """
+    if Object is None:
+        requireDataBase()
+        Object = ParseXMLFilesAndFillDB(cacheDir = None, fetchSize = inputArguments.fetchSize,
+                                        gzipOutput = inputArguments.gzipOutput,
+                                        columnar = inputArguments.columnar,
+                                        timer = timer)
+        Object.createDataBase(keepExisting = True) ## migrates an older database
+    Object.printReports()
+    
+def plotImageEvals(inputArguments, timer):
+    requireDataBase()
+    Object = ParseXMLFilesAndFillDB(cacheDir = None, timer = timer)
+    Object.createDataBase(keepExisting = True) ## migrates an older database, which has no ScoreHistogram
+    Object.closeDataBase()
+    PlotObject = MakeBoxplots(processes = inputArguments.plotProcesses,
+                              perSiteDir = inputArguments.perSitePlotDir, timer = timer)
+    PlotObject.main()
+    
+def runImageEval(inputArguments, timer):
+    """
+    Run the stages of the command: "sync" builds or updates the database,
+    "export" writes its CSV files, "plot" makes the boxplots and "all" does
+    the three (without "sync" with --useCurrentDatabase).
+    """
+    command = inputArguments.command
+    Object = None
+    if command == 'sync' or (command == 'all' and not inputArguments.useCurrentDatabase):
+        Object = syncImageEvals(inputArguments, timer)
+    if command in ('export', 'all'):
+        exportImageEvals(inputArguments, timer, Object)
+    elif Object is not None:
+        Object.closeDataBase()
+    if command in ('plot', 'all'):
+        plotImageEvals(inputArguments, timer)
+
+def makeArgumentParser():
+    """ Returns the parser of the command line, with one subparser for each of COMMANDS. """
+    syncParser = argparse.ArgumentParser(add_help=False)
+    syncOptions = syncParser.add_argument_group('sync options')
+    syncOptions.add_argument('--xnatURL', action='store', default='https://www.predict-hd.net/xnat',
+                    dest='xnatURL', help='Base URL of the XNAT server')
+    syncOptions.add_argument('-j', '--workers', action='store', type=int, default=8,
+                    dest='workers', help='Number of concurrent XNAT downloads')
+    syncOptions.add_argument('--retries', action='store', type=int, default=3,
+                    dest='retries', help='Number of times a failed XNAT download is retried')
+    syncOptions.add_argument('--timeout', action='store', type=float, default=60,
+                    dest='timeout', help='Timeout in seconds for each XNAT request')
+    syncOptions.add_argument('-i', '--incremental', action='store_true', default=False,
+                    dest='incremental', help='Update the current database with new, changed and '
+                    'removed XNAT experiments instead of rebuilding it')
+    syncOptions.add_argument('--cacheDir', action='store', default='xnat_cache',
+                    dest='cacheDir', help='Directory of the local cache of XNAT documents')
+    syncOptions.add_argument('--cacheSize', action='store', type=int, default=1024,
+                    dest='cacheSize', help='Maximum size of the XNAT cache in megabytes')
+    syncOptions.add_argument('--noCache', action='store_true', default=False,
+                    dest='noCache', help='Do not cache the documents downloaded from XNAT')
+    syncOptions.add_argument('--offline', action='store_true', default=False,
+                    dest='offline', help='Build the database from the XNAT cache without using the network')
+    syncOptions.add_argument('--batchSize', action='store', type=int, default=500,
+                    dest='batchSize', help='Number of rows written to the database with each INSERT batch')
+    syncOptions.add_argument('--commitSize', action='store', type=int, default=5000,
+                    dest='commitSize', help='Number of rows written to the database in each transaction')
+    syncOptions.add_argument('--noBulk', action='store_true', default=False,
+                    dest='noBulk', help='Download every Image Eval XML file instead of reading the '
+                    'Image Eval fields from the experiment listing')
+    syncOptions.add_argument('--pageSize', action='store', type=int, default=5000,
+                    dest='pageSize', help='Number of experiments in each page of the experiment listing '
+                    '(0 downloads the listing with one request)')
+    syncOptions.add_argument('--dirCacheFile', action='store', default=None,
+                    dest='dirCacheFile', help='File that keeps the listings of the image directories '
+                    'between runs, unchanged directories are not listed again')
+    syncOptions.add_argument('--parseProcesses', action='store', type=int, default=0,
+                    dest='parseProcesses', help='Number of processes that parse the Image Eval XML files '
+                    '(0 parses them in one thread of the main process)')
+    syncOptions.add_argument('--queueSize', action='store', type=int, default=64,
+                    dest='queueSize', help='Number of items each stage of the database pipeline may queue')
+    syncOptions.add_argument('--maxInFlight', action='store', type=int, default=0,
+                    dest='maxInFlight', help='Largest number of experiments in the database pipeline at once '
+                    '(0 is limited by the queues only)')
+    syncOptions.add_argument('--resume', action='store_true', default=False,
+                    dest='resume', help='Continue a sync that stopped part way with the experiment list saved in '
+                    'ImageEvals.db, skipping the experiments already loaded and retrying the failed ones')
+    syncOptions.add_argument('--retryPasses', action='store', type=int, default=1,
+                    dest='retryPasses', help='Number of times the experiments that could not be loaded are '
+                    'retried at the end of the sync')
+    syncOptions.add_argument('--imageRoot', action='store', default='/paulsen/MRx',
+                    dest='imageRoot', help='Directory that holds the image files of every project')
+    
+    exportParser = argparse.ArgumentParser(add_help=False)
+    exportOptions = exportParser.add_argument_group('export options')
+    exportOptions.add_argument('--fetchSize', action='store', type=int, default=1000,
+                    dest='fetchSize', help='Number of database rows read at a time by the CSV exports')
+    exportOptions.add_argument('--gzip', action='store_true', default=False,
+                    dest='gzipOutput', help='Write the CSV exports gzip compressed (*.csv.gz)')
+    exportOptions.add_argument('--columnar', action='store_true', default=False,
+                    dest='columnar', help='Also write the database to ImageEval_database.parquet (with pyarrow) '
+                    'or ImageEval_database.cols for analysis jobs')
+    
+    plotParser = argparse.ArgumentParser(add_help=False)
+    plotOptions = plotParser.add_argument_group('plot options')
+    plotOptions.add_argument('--plotProcesses', action='store', type=int, default=None,
+                    dest='plotProcesses', help='Number of processes that render the per site boxplots '
+                    '(default: the number of CPUs), needs PyPDF2 to join their pages')
+    plotOptions.add_argument('--perSitePlotDir', action='store', default=None,
+                    dest='perSitePlotDir', help='Also keep one boxplot PDF per site in this directory, '
+                    'sites whose data did not change are not rendered again')
+    
+    runParser = argparse.ArgumentParser(add_help=False)
+    runParser.add_argument('--timingFile', action='store', default='ImageEval_timings.json',
+                    dest='timingFile', help='JSON file with the count, p50/p95/p99 duration and bytes of every '
+                    'phase of the run')
+    runParser.add_argument('--profile', action='store', nargs='?', default=None, const='createImageEvalDB.prof',
+                    dest='profile', help='Run under cProfile and save the statistics to this file '
+                    '(default: createImageEvalDB.prof)')
+    
+    parser = argparse.ArgumentParser(description='Build the Image Eval database from XNAT, export it and '
+                                     'plot it.  Without a command, "all" is run.')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('sync', parents=[syncParser, runParser],
+                        help='Build the ImageEvals.db database from XNAT, or update it')
+    commands.add_parser('export', parents=[exportParser, runParser],
+                        help='Write the CSV files of ImageEvals.db')
+    commands.add_parser('plot', parents=[plotParser, runParser],
+                        help='Make the boxplot PDF files of ImageEvals.db')
+    allParser = commands.add_parser('all', parents=[syncParser, exportParser, plotParser, runParser],
+                                    help='sync, export and plot (the default)')
+    allParser.add_argument('-r', '--useCurrentDatabase', action='store_true', default=False,
+                    dest='useCurrentDatabase', help='Use the current database to make boxplots')
+    return parser
 
 if __name__ == "__main__":
    # Create and parse input arguments
-    parser = argparse.ArgumentParser(description='')
-    parser.add_argument('-r', '--useCurrentDatabase', action='store_true', default=False,
-                    dest='useCurrentDatabase', help='Use the current database to make boxplots')
-    inputArguments = parser.parse_args()    
+    parser = makeArgumentParser()
+    arguments = sys.argv[1:]
+    if not arguments or arguments[0] not in COMMANDS + ('-h', '--help'):
+        arguments = ['all'] + arguments
+    inputArguments = parser.parse_args(arguments)
+    if getattr(inputArguments, 'offline', False) and inputArguments.noCache:
+        parser.error("--offline builds the database from the XNAT cache and cannot be used with --noCache")
     
     start_time = datetime.datetime.now()
-    if inputArguments.useCurrentDatabase is False:
-        Object = ParseXMLFilesAndFillDB()
-        Object.main()
+    timer = PhaseTimer()
+    if inputArguments.profile is None:
+        runImageEval(inputArguments, timer)
     else:
-        if os.path.exists("ImageEvals.db"):
-            Object = ParseXMLFilesAndFillDB()
-            Object.printDBtoCSVfile()
-            Object.printAutoWorkupCSV()
-            Object.printImagesNotInFileSystem()
-        else:
-            print("ERROR: No ImageEvals.db in current directory")
-            sys.exit(-1)
-    PlotObject = MakeBoxplots()
-    PlotObject.main()
+        ## only the main thread is profiled, the pipeline stages are covered by the timing summary
+        profiler = cProfile.Profile()
+        profiler.runcall(runImageEval, inputArguments, timer)
+        profiler.dump_stats(inputArguments.profile)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(30)
+        print "Profile saved to {0}".format(inputArguments.profile)
+    timer.printSummary()
+    timer.save(inputArguments.timingFile)
+    print "Timing summary saved to {0}".format(inputArguments.timingFile)
     print "-"*50
     print "The program took "
     print datetime.datetime.now() - start_time
@@ -0,0 +1,104 @@
+"""
+imageEvalFileNames.py
+
+The naming convention of the image files of the Image Evals.  An image
+file is named <subject>_<session>_<scan type>_<series number>.nii.gz and
+stored under <image root>/<project>/<subject>/<session>/ANONRAW.  Some
+projects name their sessions differently; their rule is listed in
+PROJECT_RULES, every other project uses DEFAULT_RULE.
+
+parseImageFile() reads the subject, session and scan type of one image
+file name.  parseImageFiles() does the same for a whole column of image
+file names at once, into lists, and also returns the image file
+names forced to the mandated format.
+"""
+import collections,itertools,re
+
+NOT_FOUND = ("NOT_FOUND", "NOT_FOUND", "NOT_FOUND")
+## the scan types whose PD and T2 images are evaluated together and stored in separate files
+PDT2_SCAN_TYPES = frozenset(['PDT2-15', 'PD-15', 'T2-15'])
+
+## the lists returned by parseImageFiles()
+ImageFileNames = collections.namedtuple('ImageFileNames', ['subject', 'session', 'scantype', 'imagefile'])
+
+class FileNameRule():
+    """
+    The image file naming rule of a project: "sessionParts" is the number
+    of "_" separated parts of its session labels.
+    """
+    def __init__(self, sessionParts = 1):
+        self.pattern = re.compile(self._groups(sessionParts, "_") + "_[^-]*")
+        ## the same pattern for the lines of a '\n' joined column, the empty
+        ## alternative keeps one match (of empty groups) for each file name that does not match
+        self.columnPattern = re.compile("^(?:[^\n]*/)?(?:" + self._groups(sessionParts, "_/\n") + "(_)|)[^\n]*",
+                                        re.MULTILINE)
+
+    def _groups(self, sessionParts, excluded):
+        part = "[^{0}]*".format(excluded)
+        return "({0})_({1})_({0})".format(part, "_".join([part] * sessionParts))
+
+    def parse(self, imagefile):
+        """ Returns the subject, session and scan type of an image file name, or NOT_FOUND. """
+        match = self.pattern.match(imagefile.strip().rsplit('/', 1)[-1])
+        if match is None:
+            return NOT_FOUND
+        return match.groups()
+
+    def parseColumn(self, imagefiles):
+        """
+        parse() of every image file name of an iterable, with one regular
+        expression search.  Returns the list of subjects, of sessions and of
+        scan types.
+        """
+        column = [name.strip() for name in imagefiles]
+        matches = self.columnPattern.findall("\n".join(column))
+        if len(matches) != len(column):
+            ## a file name with a line break
+            matches = [self.parse(imagefile) + ("_",) for imagefile in column]
+        return tuple([groups[part] if groups[3] else NOT_FOUND[part] for groups in matches] for part in range(3))
+
+DEFAULT_RULE = FileNameRule()
+PROJECT_RULES = {'PHD_DTI_THP': FileNameRule(sessionParts = 2)}
+
+IMAGE_FILE_FORMAT = "{0}/{1}/{2}/{3}/ANONRAW/{2}_{3}_{4}_{5}.nii.gz"
+
+def getRule(project):
+    return PROJECT_RULES.get(project, DEFAULT_RULE)
+
+def parseImageFile(imagefile, project):
+    """ Returns the subject, session and scan type of an image file name of "project", or NOT_FOUND. """
+    return getRule(project).parse(imagefile)
+
+def makeImageFile(imageRoot, project, subject, session, scanType, seriesNumber):
+    """ Returns the image file name in the mandated format. """
+    return IMAGE_FILE_FORMAT.format(imageRoot.rstrip('/'), project, subject, session, scanType, seriesNumber)
+
+def parseImageFiles(imagefiles, projects, imageProjects, seriesNumbers, imageRoot):
+    """
+    Parses a column of image file names: "projects" selects the naming
+    rule of each one, "imageProjects" and "seriesNumbers" are the project
+    directory and series number of its forced name.  Returns an
+    ImageFileNames of lists as long as "imagefiles"; file names that do
+    not follow their rule get NOT_FOUND.
+    """
+    names = DEFAULT_RULE.parseColumn(imagefiles)
+    ## the file names of the projects with their own rule are parsed again with it
+    for (project, rule) in PROJECT_RULES.items():
+        indexes = [index for (index, name) in enumerate(projects) if name == project]
+        if indexes:
+            for (column, values) in zip(names, rule.parseColumn([imagefiles[index] for index in indexes])):
+                for (index, value) in itertools.izip(indexes, values):
+                    column[index] = value
+    (subjects, sessions, scanTypes) = names
+    imageRoot = imageRoot.rstrip('/')
+    forced = [IMAGE_FILE_FORMAT.format(imageRoot, *values)
+              for values in itertools.izip(imageProjects, subjects, sessions, scanTypes, seriesNumbers)]
+    return ImageFileNames(subjects, sessions, scanTypes, forced)
+
+def getPDT2ImageFiles(scanType, imagefile):
+    """ Returns the PD-15 and T2-15 image file names of a scan of PDT2_SCAN_TYPES. """
+    if scanType == 'PDT2-15':
+        return (imagefile.replace('_PDT2-15_', '_PD-15_'), imagefile.replace('_PDT2-15_', '_T2-15_'))
+    elif scanType == 'PD-15':
+        return (imagefile, imagefile.replace('_PD-15_', '_T2-15_'))
+    return (imagefile.replace('_T2-15_', '_PD-15_'), imagefile)